@@ -1999,6 +1999,12 @@ def record_emotional_state():
         
         record_id = psychological_analyzer.record_emotional_state(data['user_session'], data)
         
+        if record_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'Erreur lors de l\'enregistrement'
+            })
+        
         return jsonify({
             'success': True,
             'record_id': record_id,
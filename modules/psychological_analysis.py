@@ -2,10 +2,19 @@
 Analyse Psychologique - Suivi des émotions et impact sur la performance
 """
 import json
+import bisect
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
 from enum import Enum
+from types import MappingProxyType
+
+# Configuration de la base de données
+DATABASE = 'data/mindtraderpro_users.db'
 
 class EmotionType(Enum):
     CALM = "calme"
@@ -19,12 +28,47 @@ class EmotionType(Enum):
     ANGRY = "en_colère"
     EUPHORIC = "euphorique"
 
+# Correspondance valeur -> membre, évite le passage par EnumMeta.__call__
+_EMOTION_BY_VALUE = {e.value: e for e in EmotionType}
+
+# Nombre maximal de scores mentaux conservés par utilisateur
+MAX_SCORE_HISTORY = 10000
+
+# Dépassement toléré avant de tronquer l'historique des scores (suppression par blocs)
+SCORE_HISTORY_TRIM_CHUNK = 1000
+
+# Durée de validité d'un rapport psychologique en cache (secondes)
+REPORT_CACHE_TTL = 600
+
+# Fenêtre d'analyse des rapports et profils (jours)
+ANALYSIS_WINDOW_DAYS = 30
+
+# Nombre d'enregistrements récents lus pour les insights rapides
+INSIGHTS_RECORDS = 10
+
+# Colonnes lues pour reconstruire un EmotionalRecord (voir _record_from_row)
+_RECORD_COLUMNS = '''
+    record_id, trade_id, ts, phase, confidence_level, stress_level,
+    fear_level, greed_level, patience_level, primary_emotion,
+    secondary_emotions, market_conditions, time_of_day,
+    sleep_quality, external_stress, emotional_notes, trigger_events
+'''
+
+# Corrélations émotions-performance simulées (en production, utiliser les vraies performances)
+_PLACEHOLDER_CORRELATIONS = MappingProxyType({
+    'confidence_vs_performance': 0.75,
+    'stress_vs_performance': -0.45,
+    'fear_vs_performance': -0.60,
+    'patience_vs_performance': 0.80,
+    'sleep_quality_vs_performance': 0.65
+})
+
 class TradingPhase(Enum):
     BEFORE_TRADE = "avant_trade"
     DURING_TRADE = "pendant_trade"
     AFTER_TRADE = "apres_trade"
 
-@dataclass
+@dataclass(slots=True)
 class EmotionalRecord:
     """Enregistrement émotionnel"""
     record_id: str
@@ -54,7 +98,7 @@ class EmotionalRecord:
     emotional_notes: str
     trigger_events: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class PsychologicalProfile:
     """Profil psychologique du trader"""
     user_session: str
@@ -83,32 +127,224 @@ class PsychologicalProfile:
     created_at: datetime
     last_updated: datetime
 
+# Messages de recommandation, indexés par code stable
+_RECOMMENDATIONS = {
+    'high_stress': "🧘 Votre niveau de stress est élevé. Essayez des techniques de relaxation avant de trader.",
+    'low_confidence': "💪 Travaillez sur votre confiance en vous. Commencez par des positions plus petites.",
+    'low_patience': "⏰ Développez votre patience. Les meilleures opportunités demandent d'attendre.",
+    'sleep_impact': "😴 Votre sommeil impacte vos performances. Visez 7-8h de sommeil par nuit.",
+    'frequent_anxiety': "😰 Vous ressentez souvent de l'anxiété. Réduisez la taille de vos positions.",
+    'frequent_greed': "💰 Attention à la cupidité. Respectez vos objectifs de Take Profit.",
+    'balanced': "🎯 Votre équilibre émotionnel semble bon. Continuez ainsi !"
+}
+
+# Règles de recommandation : (code, prédicat(stats, corrélations))
+_RULES = (
+    ('high_stress', lambda s, c: s['avg_stress'] > 7),
+    ('low_confidence', lambda s, c: s['avg_confidence'] < 5),
+    ('low_patience', lambda s, c: s['avg_patience'] < 5),
+    ('sleep_impact', lambda s, c: c.get('sleep_quality_vs_performance', 0) > 0.5),
+)
+
+# Seuils de fréquence des émotions dominantes : (code, émotion, part maximale)
+_EMOTION_FREQUENCY_THRESHOLDS = (
+    ('frequent_anxiety', EmotionType.ANXIOUS.value, 0.3),
+    ('frequent_greed', EmotionType.GREEDY.value, 0.2),
+)
+
 class PsychologicalAnalyzer:
     """Analyseur psychologique pour traders"""
     
-    def __init__(self):
-        self.emotional_records = {}  # user_session -> List[EmotionalRecord]
+    def __init__(self, db_path: str = DATABASE):
+        self.db_path = db_path
         self.psychological_profiles = {}  # user_session -> PsychologicalProfile
         self.mental_score_history = {}  # user_session -> List[score_data]
+        # Horodatages (epoch) parallèles à l'historique des scores, triés par insertion
+        self._score_timestamps = {}  # user_session -> List[float]
+        # Rapports en cache : user_session -> (nb d'enregistrements en base, instant monotone, rapport)
+        self._report_cache = {}
         
+        self._init_tables()
+    
+    @contextmanager
+    def _connect(self):
+        """Ouvre une connexion à la base, fermée en sortie de bloc même en cas d'erreur"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def _init_tables(self):
+        """Initialise la table des enregistrements émotionnels"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS emotional_records (
+                        record_id TEXT PRIMARY KEY,
+                        user_session TEXT NOT NULL,
+                        trade_id TEXT,
+                        ts REAL NOT NULL,
+                        phase TEXT NOT NULL,
+                        confidence_level INTEGER,
+                        stress_level INTEGER,
+                        fear_level INTEGER,
+                        greed_level INTEGER,
+                        patience_level INTEGER,
+                        primary_emotion TEXT NOT NULL,
+                        secondary_emotions TEXT,
+                        market_conditions TEXT,
+                        time_of_day TEXT,
+                        sleep_quality INTEGER,
+                        external_stress INTEGER,
+                        emotional_notes TEXT,
+                        trigger_events TEXT
+                    )
+                ''')
+                
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_emotional_records_session_ts ON emotional_records(user_session, ts)')
+                
+                conn.commit()
+            
+        except Exception as e:
+            print(f"Erreur initialisation tables émotionnelles: {e}")
+    
+    def _record_from_row(self, user_session: str, row) -> EmotionalRecord:
+        """Reconstruit un EmotionalRecord à partir d'une ligne _RECORD_COLUMNS"""
+        return EmotionalRecord(
+            record_id=row[0],
+            user_session=user_session,
+            trade_id=row[1],
+            timestamp=datetime.fromtimestamp(row[2]),
+            phase=TradingPhase(row[3]),
+            confidence_level=row[4],
+            stress_level=row[5],
+            fear_level=row[6],
+            greed_level=row[7],
+            patience_level=row[8],
+            primary_emotion=_EMOTION_BY_VALUE[row[9]],
+            secondary_emotions=[_EMOTION_BY_VALUE[e] for e in json.loads(row[10] or '[]')],
+            market_conditions=row[11],
+            time_of_day=row[12],
+            sleep_quality=row[13],
+            external_stress=row[14],
+            emotional_notes=row[15],
+            trigger_events=json.loads(row[16] or '[]')
+        )
+    
+    def _latest_records(self, user_session: str, limit: int) -> List[EmotionalRecord]:
+        """Retourne les N derniers enregistrements d'un utilisateur, du plus ancien au plus récent"""
+        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {_RECORD_COLUMNS}
+                FROM emotional_records
+                WHERE user_session = ?
+                ORDER BY ts DESC, rowid DESC
+                LIMIT ?
+            ''', (user_session, limit))
+            rows = cursor.fetchall()
+        
+        return [self._record_from_row(user_session, row) for row in reversed(rows)]
+    
+    def _save_record(self, record: EmotionalRecord, ts: float) -> bool:
+        """Persiste un enregistrement émotionnel"""
+        try:
+            with self._connect() as conn:
+                conn.execute('''
+                    INSERT INTO emotional_records (
+                        record_id, user_session, trade_id, ts, phase, confidence_level,
+                        stress_level, fear_level, greed_level, patience_level,
+                        primary_emotion, secondary_emotions, market_conditions,
+                        time_of_day, sleep_quality, external_stress, emotional_notes,
+                        trigger_events
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    record.record_id, record.user_session, record.trade_id, ts,
+                    record.phase.value, record.confidence_level, record.stress_level,
+                    record.fear_level, record.greed_level, record.patience_level,
+                    record.primary_emotion.value,
+                    json.dumps([e.value for e in record.secondary_emotions]),
+                    record.market_conditions, record.time_of_day, record.sleep_quality,
+                    record.external_stress, record.emotional_notes,
+                    json.dumps(record.trigger_events)
+                ))
+                conn.commit()
+            return True
+            
+        except Exception as e:
+            print(f"Erreur sauvegarde enregistrement émotionnel: {e}")
+            return False
+    
+    def _count_records(self, cursor, user_session: str) -> int:
+        """Nombre total d'enregistrements d'un utilisateur (parcours de l'index)"""
+        cursor.execute('SELECT COUNT(*) FROM emotional_records WHERE user_session = ?', (user_session,))
+        return cursor.fetchone()[0]
+    
+    def _window_stats(self, cursor, user_session: str, now: datetime) -> Optional[Dict]:
+        """Agrège en SQL les enregistrements des 30 derniers jours (None si la fenêtre est vide)"""
+        
+        cutoff = (now - timedelta(days=ANALYSIS_WINDOW_DAYS)).timestamp()
+        
+        cursor.execute('''
+            SELECT COUNT(*), AVG(confidence_level), AVG(stress_level), AVG(fear_level),
+                   AVG(greed_level), AVG(patience_level),
+                   MAX(confidence_level), MIN(confidence_level),
+                   MAX(stress_level), MIN(stress_level)
+            FROM emotional_records
+            WHERE user_session = ? AND ts > ?
+        ''', (user_session, cutoff))
+        row = cursor.fetchone()
+        
+        if not row[0]:
+            return None
+        
+        # Émotions par fréquence décroissante, égalité : première apparition
+        cursor.execute('''
+            SELECT primary_emotion, COUNT(*)
+            FROM emotional_records
+            WHERE user_session = ? AND ts > ?
+            GROUP BY primary_emotion
+            ORDER BY COUNT(*) DESC, MIN(rowid)
+        ''', (user_session, cutoff))
+        
+        return {
+            'cutoff': cutoff,
+            'total': row[0],
+            'avg_confidence': row[1],
+            'avg_stress': row[2],
+            'avg_fear': row[3],
+            'avg_greed': row[4],
+            'avg_patience': row[5],
+            'max_confidence': row[6],
+            'min_confidence': row[7],
+            'max_stress': row[8],
+            'min_stress': row[9],
+            'emotion_counts': dict(cursor.fetchall())
+        }
+    
     def record_emotional_state(self, user_session: str, emotional_data: Dict) -> str:
         """Enregistre l'état émotionnel d'un trader"""
         
-        record_id = f"emotion_{int(datetime.now().timestamp())}_{user_session}"
+        now = datetime.now()
+        record_id = f"emotion_{secrets.token_hex(6)}"
         
         record = EmotionalRecord(
             record_id=record_id,
             user_session=user_session,
             trade_id=emotional_data.get('trade_id'),
-            timestamp=datetime.now(),
+            timestamp=now,
             phase=TradingPhase(emotional_data.get('phase', 'before_trade')),
             confidence_level=emotional_data.get('confidence_level', 5),
             stress_level=emotional_data.get('stress_level', 5),
             fear_level=emotional_data.get('fear_level', 5),
             greed_level=emotional_data.get('greed_level', 5),
             patience_level=emotional_data.get('patience_level', 5),
-            primary_emotion=EmotionType(emotional_data.get('primary_emotion', 'calm')),
-            secondary_emotions=[EmotionType(e) for e in emotional_data.get('secondary_emotions', [])],
+            primary_emotion=_EMOTION_BY_VALUE[emotional_data.get('primary_emotion', 'calm')],
+            secondary_emotions=[_EMOTION_BY_VALUE[e] for e in emotional_data.get('secondary_emotions', [])],
             market_conditions=emotional_data.get('market_conditions', 'normal'),
             time_of_day=emotional_data.get('time_of_day', 'morning'),
             sleep_quality=emotional_data.get('sleep_quality', 7),
@@ -117,14 +353,12 @@ class PsychologicalAnalyzer:
             trigger_events=emotional_data.get('trigger_events', [])
         )
         
-        # Sauvegarder l'enregistrement
-        if user_session not in self.emotional_records:
-            self.emotional_records[user_session] = []
-        
-        self.emotional_records[user_session].append(record)
+        # Sauvegarder l'enregistrement (None si la base est indisponible)
+        if not self._save_record(record, now.timestamp()):
+            return None
         
         # Mettre à jour le profil psychologique
-        self._update_psychological_profile(user_session)
+        self._update_psychological_profile(user_session, now)
         
         return record_id
     
@@ -166,12 +400,13 @@ class PsychologicalAnalyzer:
             trade_recommendation = "Évitez de trader, état mental défavorable"
             color = "danger"
         
+        now = datetime.now()
         score_data = {
             'mental_score': round(mental_score, 1),
             'mental_state': mental_state,
             'trade_recommendation': trade_recommendation,
             'color': color,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'factors': {
                 'positive': {
                     'confidence': confidence,
@@ -187,214 +422,176 @@ class PsychologicalAnalyzer:
             }
         }
         
-        # Sauvegarder l'historique
-        if user_session not in self.mental_score_history:
-            self.mental_score_history[user_session] = []
+        # Sauvegarder l'historique (listes indexables, tronquées par blocs)
+        history = self.mental_score_history.setdefault(user_session, [])
+        timestamps = self._score_timestamps.setdefault(user_session, [])
+        history.append(score_data)
+        timestamps.append(now.timestamp())
         
-        self.mental_score_history[user_session].append(score_data)
+        if len(history) > MAX_SCORE_HISTORY + SCORE_HISTORY_TRIM_CHUNK:
+            excess = len(history) - MAX_SCORE_HISTORY
+            del history[:excess]
+            del timestamps[:excess]
         
         return score_data
     
     def generate_psychological_report(self, user_session: str) -> Dict:
         """Génère un rapport psychologique complet"""
         
-        records = self.emotional_records.get(user_session, [])
-        if not records:
-            return {
-                'success': False,
-                'error': 'Aucune donnée émotionnelle disponible'
-            }
-        
-        # Analyser les 30 derniers jours
-        cutoff_date = datetime.now() - timedelta(days=30)
-        recent_records = [r for r in records if r.timestamp > cutoff_date]
-        
-        if not recent_records:
-            return {
-                'success': False,
-                'error': 'Aucune donnée récente disponible'
-            }
-        
-        # Calculs statistiques
-        avg_confidence = sum(r.confidence_level for r in recent_records) / len(recent_records)
-        avg_stress = sum(r.stress_level for r in recent_records) / len(recent_records)
-        avg_fear = sum(r.fear_level for r in recent_records) / len(recent_records)
-        avg_patience = sum(r.patience_level for r in recent_records) / len(recent_records)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                
+                total_records = self._count_records(cursor, user_session)
+                if not total_records:
+                    return {
+                        'success': False,
+                        'error': 'Aucune donnée émotionnelle disponible'
+                    }
+                
+                # Rapport en cache tant qu'aucun nouvel enregistrement n'a été ajouté en base
+                cached = self._report_cache.get(user_session)
+                if cached and cached[0] == total_records and time.monotonic() - cached[1] < REPORT_CACHE_TTL:
+                    return cached[2]
+                
+                # Analyser les 30 derniers jours (agrégats calculés par SQLite)
+                now = datetime.now()
+                stats = self._window_stats(cursor, user_session, now)
+                
+                if stats is None:
+                    return {
+                        'success': False,
+                        'error': 'Aucune donnée récente disponible'
+                    }
+                
+                # Analyse des patterns temporels
+                time_patterns = self._analyze_time_patterns(cursor, user_session, stats['cutoff'])
+            
+        except Exception as e:
+            return {'success': False, 'error': f'Erreur: {str(e)}'}
         
         # Émotions les plus fréquentes
-        emotion_counts = {}
-        for record in recent_records:
-            emotion = record.primary_emotion.value
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
-        dominant_emotions = sorted(emotion_counts.items(), key=lambda x: x[1], reverse=True)[:3]
-        
-        # Analyse des patterns temporels
-        time_patterns = self._analyze_time_patterns(recent_records)
+        dominant_emotions = list(stats['emotion_counts'].items())[:3]
         
         # Corrélations émotions-performance
-        performance_correlations = self._analyze_emotion_performance(user_session, recent_records)
+        performance_correlations = self._analyze_emotion_performance(user_session)
         
         # Recommandations personnalisées
-        recommendations = self._generate_recommendations(recent_records, performance_correlations)
+        recommendations = self._generate_recommendations(stats, performance_correlations)
         
         report = {
             'success': True,
             'period': '30 derniers jours',
-            'total_records': len(recent_records),
+            'total_records': stats['total'],
             'emotional_summary': {
-                'avg_confidence': round(avg_confidence, 1),
-                'avg_stress': round(avg_stress, 1),
-                'avg_fear': round(avg_fear, 1),
-                'avg_patience': round(avg_patience, 1),
+                'avg_confidence': round(stats['avg_confidence'], 1),
+                'avg_stress': round(stats['avg_stress'], 1),
+                'avg_fear': round(stats['avg_fear'], 1),
+                'avg_patience': round(stats['avg_patience'], 1),
                 'dominant_emotions': dominant_emotions
             },
             'time_patterns': time_patterns,
-            'performance_correlations': performance_correlations,
+            'performance_correlations': dict(performance_correlations),
             'recommendations': recommendations,
-            'generated_at': datetime.now().isoformat()
+            'generated_at': now.isoformat()
         }
         
+        self._report_cache[user_session] = (total_records, time.monotonic(), report)
+        
         return report
     
-    def _analyze_time_patterns(self, records: List[EmotionalRecord]) -> Dict:
-        """Analyse les patterns temporels des émotions"""
-        
-        # Analyse par moment de la journée
-        time_emotions = {}
-        for record in records:
-            time_period = record.time_of_day
-            if time_period not in time_emotions:
-                time_emotions[time_period] = {
-                    'confidence': [],
-                    'stress': [],
-                    'count': 0
-                }
-            
-            time_emotions[time_period]['confidence'].append(record.confidence_level)
-            time_emotions[time_period]['stress'].append(record.stress_level)
-            time_emotions[time_period]['count'] += 1
-        
-        # Calculer les moyennes
-        time_analysis = {}
-        for period, data in time_emotions.items():
-            if data['count'] > 0:
-                time_analysis[period] = {
-                    'avg_confidence': round(sum(data['confidence']) / len(data['confidence']), 1),
-                    'avg_stress': round(sum(data['stress']) / len(data['stress']), 1),
-                    'sample_size': data['count']
-                }
+    def _analyze_time_patterns(self, cursor, user_session: str, cutoff: float) -> Dict:
+        """Analyse les patterns temporels des émotions (moyennes par moment de la journée)"""
         
-        return time_analysis
-    
-    def _analyze_emotion_performance(self, user_session: str, records: List[EmotionalRecord]) -> Dict:
-        """Analyse la corrélation entre émotions et performance"""
+        cursor.execute('''
+            SELECT time_of_day, AVG(confidence_level), AVG(stress_level), COUNT(*)
+            FROM emotional_records
+            WHERE user_session = ? AND ts > ?
+            GROUP BY time_of_day
+            ORDER BY MIN(rowid)
+        ''', (user_session, cutoff))
         
-        # Simulation de corrélations (en production, utiliser les vraies performances)
-        correlations = {
-            'confidence_vs_performance': 0.75,
-            'stress_vs_performance': -0.45,
-            'fear_vs_performance': -0.60,
-            'patience_vs_performance': 0.80,
-            'sleep_quality_vs_performance': 0.65
+        return {
+            period: {
+                'avg_confidence': round(avg_confidence, 1),
+                'avg_stress': round(avg_stress, 1),
+                'sample_size': count
+            }
+            for period, avg_confidence, avg_stress, count in cursor.fetchall()
         }
+    
+    def _analyze_emotion_performance(self, user_session: str) -> MappingProxyType:
+        """Analyse la corrélation entre émotions et performance"""
         
-        return correlations
+        return _PLACEHOLDER_CORRELATIONS
     
-    def _generate_recommendations(self, records: List[EmotionalRecord], correlations: Dict) -> List[str]:
+    def _generate_recommendations(self, stats: Dict, correlations: Dict) -> List[str]:
         """Génère des recommandations personnalisées"""
         
-        recommendations = []
+        recommendations = [_RECOMMENDATIONS[code] for code, predicate in _RULES if predicate(stats, correlations)]
         
-        # Analyser les niveaux moyens
-        avg_stress = sum(r.stress_level for r in records) / len(records)
-        avg_confidence = sum(r.confidence_level for r in records) / len(records)
-        avg_patience = sum(r.patience_level for r in records) / len(records)
-        
-        if avg_stress > 7:
-            recommendations.append("🧘 Votre niveau de stress est élevé. Essayez des techniques de relaxation avant de trader.")
-        
-        if avg_confidence < 5:
-            recommendations.append("💪 Travaillez sur votre confiance en vous. Commencez par des positions plus petites.")
-        
-        if avg_patience < 5:
-            recommendations.append("⏰ Développez votre patience. Les meilleures opportunités demandent d'attendre.")
-        
-        # Recommandations basées sur les corrélations
-        if correlations.get('sleep_quality_vs_performance', 0) > 0.5:
-            recommendations.append("😴 Votre sommeil impacte vos performances. Visez 7-8h de sommeil par nuit.")
-        
-        # Analyse des émotions dominantes
-        emotion_counts = {}
-        for record in records:
-            emotion = record.primary_emotion.value
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
-        if emotion_counts.get('anxieux', 0) > len(records) * 0.3:
-            recommendations.append("😰 Vous ressentez souvent de l'anxiété. Réduisez la taille de vos positions.")
-        
-        if emotion_counts.get('cupide', 0) > len(records) * 0.2:
-            recommendations.append("💰 Attention à la cupidité. Respectez vos objectifs de Take Profit.")
+        emotion_counts = stats['emotion_counts']
+        total = stats['total']
+        recommendations.extend(
+            _RECOMMENDATIONS[code]
+            for code, emotion, share in _EMOTION_FREQUENCY_THRESHOLDS
+            if emotion_counts.get(emotion, 0) > total * share
+        )
         
         if not recommendations:
-            recommendations.append("🎯 Votre équilibre émotionnel semble bon. Continuez ainsi !")
+            recommendations.append(_RECOMMENDATIONS['balanced'])
         
         return recommendations
     
-    def _update_psychological_profile(self, user_session: str):
+    def _update_psychological_profile(self, user_session: str, now: datetime):
         """Met à jour le profil psychologique"""
         
-        records = self.emotional_records.get(user_session, [])
-        if len(records) < 5:  # Besoin d'au moins 5 enregistrements
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                
+                if self._count_records(cursor, user_session) < 5:  # Besoin d'au moins 5 enregistrements
+                    return
+                
+                # Calculer les moyennes sur les 30 derniers jours
+                stats = self._window_stats(cursor, user_session, now)
+            
+        except Exception as e:
+            print(f"Erreur mise à jour du profil psychologique: {e}")
             return
         
-        # Calculer les moyennes sur les 30 derniers jours
-        cutoff_date = datetime.now() - timedelta(days=30)
-        recent_records = [r for r in records if r.timestamp > cutoff_date]
-        
-        if not recent_records:
+        if stats is None:
             return
         
-        avg_confidence = sum(r.confidence_level for r in recent_records) / len(recent_records)
-        avg_stress = sum(r.stress_level for r in recent_records) / len(recent_records)
-        avg_fear = sum(r.fear_level for r in recent_records) / len(recent_records)
-        avg_greed = sum(r.greed_level for r in recent_records) / len(recent_records)
-        avg_patience = sum(r.patience_level for r in recent_records) / len(recent_records)
-        
         # Identifier les émotions dominantes
-        emotion_counts = {}
-        for record in recent_records:
-            emotion = record.primary_emotion
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
-        dominant_emotions = sorted(emotion_counts.keys(), key=lambda x: emotion_counts[x], reverse=True)[:3]
+        dominant_emotions = [_EMOTION_BY_VALUE[emotion] for emotion in list(stats['emotion_counts'])[:3]]
         
         # Identifier les émotions problématiques (stress, peur, cupidité élevés)
         problematic_emotions = []
-        if avg_stress > 7:
+        if stats['avg_stress'] > 7:
             problematic_emotions.append(EmotionType.ANXIOUS)
-        if avg_fear > 7:
+        if stats['avg_fear'] > 7:
             problematic_emotions.append(EmotionType.FEARFUL)
-        if avg_greed > 7:
+        if stats['avg_greed'] > 7:
             problematic_emotions.append(EmotionType.GREEDY)
         
         profile = PsychologicalProfile(
             user_session=user_session,
-            avg_confidence=avg_confidence,
-            avg_stress=avg_stress,
-            avg_fear=avg_fear,
-            avg_greed=avg_greed,
-            avg_patience=avg_patience,
+            avg_confidence=stats['avg_confidence'],
+            avg_stress=stats['avg_stress'],
+            avg_fear=stats['avg_fear'],
+            avg_greed=stats['avg_greed'],
+            avg_patience=stats['avg_patience'],
             dominant_emotions=dominant_emotions,
             problematic_emotions=problematic_emotions,
             best_emotional_state={
-                'confidence': max(r.confidence_level for r in recent_records),
-                'stress': min(r.stress_level for r in recent_records),
+                'confidence': stats['max_confidence'],
+                'stress': stats['min_stress'],
                 'description': 'État optimal identifié'
             },
             worst_emotional_state={
-                'confidence': min(r.confidence_level for r in recent_records),
-                'stress': max(r.stress_level for r in recent_records),
+                'confidence': stats['min_confidence'],
+                'stress': stats['max_stress'],
                 'description': 'État problématique identifié'
             },
             emotion_performance_correlation={
@@ -402,9 +599,9 @@ class PsychologicalAnalyzer:
                 'stress': -0.45,
                 'patience': 0.80
             },
-            recommendations=self._generate_recommendations(recent_records, {}),
-            created_at=datetime.now() if user_session not in self.psychological_profiles else self.psychological_profiles[user_session].created_at,
-            last_updated=datetime.now()
+            recommendations=self._generate_recommendations(stats, {}),
+            created_at=now if user_session not in self.psychological_profiles else self.psychological_profiles[user_session].created_at,
+            last_updated=now
         )
         
         self.psychological_profiles[user_session] = profile
@@ -412,29 +609,33 @@ class PsychologicalAnalyzer:
     def get_mental_score_history(self, user_session: str, days: int = 30) -> List[Dict]:
         """Récupère l'historique des scores mentaux"""
         
-        history = self.mental_score_history.get(user_session, [])
+        history = self.mental_score_history.get(user_session)
+        if not history:
+            return []
+        
+        # Au plus MAX_SCORE_HISTORY scores exposés, même avant la prochaine troncature
+        start = max(0, len(history) - MAX_SCORE_HISTORY)
         
         if days > 0:
-            cutoff_date = datetime.now() - timedelta(days=days)
-            history = [
-                score for score in history 
-                if datetime.fromisoformat(score['timestamp']) > cutoff_date
-            ]
+            cutoff = (datetime.now() - timedelta(days=days)).timestamp()
+            start = bisect.bisect_right(self._score_timestamps[user_session], cutoff, lo=start)
         
-        return history
+        return history[start:]
     
     def get_emotional_insights(self, user_session: str) -> Dict:
         """Génère des insights émotionnels rapides"""
         
-        records = self.emotional_records.get(user_session, [])
-        if not records:
+        try:
+            recent_records = self._latest_records(user_session, INSIGHTS_RECORDS)
+        except Exception as e:
+            return {'message': f'Erreur: {str(e)}', 'insights': []}
+        
+        if not recent_records:
             return {
                 'message': 'Commencez à enregistrer vos émotions pour recevoir des insights !',
                 'insights': []
             }
         
-        recent_records = records[-10:] if len(records) >= 10 else records
-        
         insights = []
         
         # Analyse de tendance
@@ -4,15 +4,113 @@ Système complet de parrainage avec récompenses et anti-triche pour MindTraderP
 """
 
 import os
+import bisect
+import queue
 import sqlite3
 import secrets
+import threading
 import hashlib
+import time
+from contextlib import contextmanager
+from functools import wraps
 from datetime import datetime, timedelta
 import json
 
+from modules.grade_manager import add_user_xp_with_notifications
+
 # Configuration de la base de données
 DATABASE = 'data/mindtraderpro_users.db'
 
+# Nombre maximal de connexions conservées dans le pool
+POOL_SIZE = 8
+
+# UPDATE ... RETURNING disponible à partir de SQLite 3.35
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Fonctions de fenêtrage (COUNT(*) OVER ()) disponibles à partir de SQLite 3.25
+_SUPPORTS_WINDOW = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+# Nombre de requêtes préparées conservées par connexion
+STATEMENT_CACHE_SIZE = 256
+
+# Taille des lots lus par cursor.fetchmany()
+FETCH_BATCH_SIZE = 64
+
+# Durée de mise en cache des règles de validation (secondes)
+RULES_CACHE_TTL = 60
+
+# Durée de mise en cache du leaderboard (secondes)
+LEADERBOARD_CACHE_TTL = 30
+
+# Intervalle de regroupement des auto-validations en arrière-plan (secondes)
+AUTO_VALIDATION_INTERVAL = 5
+
+# Nombre maximal de filleuls traités par passe d'auto-validation
+AUTO_VALIDATION_BATCH_SIZE = 500
+
+# Intervalle des passes de rattrapage sur tous les parrainages en attente (secondes)
+AUTO_VALIDATION_RECOVERY_INTERVAL = 300
+
+# IPs et empreintes d'appareil de confiance (NAT d'entreprise, etc.),
+# chargées depuis referral_allowlist et exemptées des contrôles de doublons
+_trusted_ips = frozenset()
+_trusted_devices = frozenset()
+
+# ============================================================================
+# GESTION DES ERREURS
+# ============================================================================
+
+def _safe(fn):
+    """Convertit toute exception en réponse {'success': False, 'error': ...}"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            return {'success': False, 'error': f'Erreur: {str(e)}'}
+    return wrapper
+
+# ============================================================================
+# POOL DE CONNEXIONS SQLITE
+# ============================================================================
+
+_connection_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def _open_connection():
+    """Ouvre une connexion configurée pour le pool"""
+    # isolation_level=None : les transactions sont ouvertes explicitement (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(
+        DATABASE,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+@contextmanager
+def get_connection():
+    """Emprunte une connexion au pool et la restitue en sortie de bloc"""
+    try:
+        conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    
+    try:
+        yield conn
+    finally:
+        # Une transaction non validée est annulée, comme à la fermeture d'une connexion
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _connection_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 # ============================================================================
 # CONFIGURATION DU SYSTÈME DE PARRAINAGE
 # ============================================================================
@@ -32,6 +130,22 @@ REFERRAL_BADGES = {
     50: {'name': 'Parrain Platine', 'icon': '💎', 'color': '#e5e4e2'}
 }
 
+# Paliers triés pour la recherche dichotomique des badges
+_BADGE_THRESHOLDS = sorted(REFERRAL_BADGES)
+
+def get_current_badge(validated_count):
+    """Retourne le badge le plus élevé atteint pour un nombre de filleuls validés"""
+    index = bisect.bisect_right(_BADGE_THRESHOLDS, validated_count) - 1
+    return REFERRAL_BADGES[_BADGE_THRESHOLDS[index]] if index >= 0 else None
+
+# Domaines d'emails temporaires considérés comme suspects
+SUSPICIOUS_DOMAINS = frozenset({
+    '10minutemail.com',
+    'mailinator.com',
+    'guerrillamail.com',
+    'tempmail.org'
+})
+
 # Offres promotionnelles pour filleuls
 REFERRAL_OFFERS = {
     'premium_discount': {
@@ -48,6 +162,15 @@ REFERRAL_OFFERS = {
     }
 }
 
+def _iter_rows(cursor, batch_size=FETCH_BATCH_SIZE):
+    """Parcourt les résultats d'un curseur par lots, sous forme de dicts"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
 # ============================================================================
 # INITIALISATION DES TABLES
 # ============================================================================
@@ -55,114 +178,261 @@ REFERRAL_OFFERS = {
 def init_referral_tables():
     """Initialise les tables du système de parrainage"""
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Table des parrainages
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER NOT NULL,
-                referee_id INTEGER,
-                referral_code TEXT UNIQUE NOT NULL,
-                signup_ip TEXT,
-                signup_device_fingerprint TEXT,
-                status TEXT DEFAULT 'pending',
-                signup_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                validation_date DATETIME,
-                validation_reason TEXT,
-                payment_made BOOLEAN DEFAULT 0,
-                email_verified BOOLEAN DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (referrer_id) REFERENCES users (id),
-                FOREIGN KEY (referee_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Table des récompenses de parrainage
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referral_rewards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                referral_id INTEGER NOT NULL,
-                reward_type TEXT NOT NULL,
-                xp_amount INTEGER DEFAULT 0,
-                badge_earned TEXT,
-                description TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (referral_id) REFERENCES referrals (id)
-            )
-        ''')
-        
-        # Table des règles de parrainage (configuration admin)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referral_rules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                rule_name TEXT UNIQUE NOT NULL,
-                rule_value TEXT NOT NULL,
-                description TEXT,
-                updated_by INTEGER,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (updated_by) REFERENCES users (id)
-            )
-        ''')
-        
-        # Table des logs anti-triche
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referral_fraud_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT,
-                device_fingerprint TEXT,
-                email TEXT,
-                referral_code TEXT,
-                fraud_type TEXT,
-                details TEXT,
-                blocked BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Index pour les performances
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_code ON referrals(referral_code)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_status ON referrals(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_referral_rewards_user ON referral_rewards(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_fraud_logs_ip ON referral_fraud_logs(ip_address)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_fraud_logs_email ON referral_fraud_logs(email)')
-        
-        # Insertion des règles par défaut
-        default_rules = [
-            ('max_referrals_per_ip', '3', 'Nombre maximum de parrainages par IP'),
-            ('validation_requires_payment', 'true', 'Validation nécessite un paiement'),
-            ('validation_requires_email', 'true', 'Validation nécessite email vérifié'),
-            ('xp_signup', '5', 'XP par inscription'),
-            ('xp_validated', '25', 'XP par filleul validé'),
-            ('offer_duration_days', '30', 'Durée des offres en jours')
-        ]
-        
-        for rule_name, rule_value, description in default_rules:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Table des parrainages
             cursor.execute('''
-                INSERT OR IGNORE INTO referral_rules (rule_name, rule_value, description)
-                VALUES (?, ?, ?)
-            ''', (rule_name, rule_value, description))
-        
-        conn.commit()
-        conn.close()
-        
-        print("✅ Tables de parrainage initialisées")
-        
+                CREATE TABLE IF NOT EXISTS referrals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    referrer_id INTEGER NOT NULL,
+                    referee_id INTEGER,
+                    referral_code TEXT UNIQUE NOT NULL,
+                    signup_ip TEXT,
+                    signup_device_fingerprint TEXT,
+                    status TEXT DEFAULT 'pending',
+                    signup_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    validation_date DATETIME,
+                    validation_reason TEXT,
+                    payment_made BOOLEAN DEFAULT 0,
+                    email_verified BOOLEAN DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (referrer_id) REFERENCES users (id),
+                    FOREIGN KEY (referee_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Table des récompenses de parrainage
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_rewards (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    referral_id INTEGER NOT NULL,
+                    reward_type TEXT NOT NULL,
+                    xp_amount INTEGER DEFAULT 0,
+                    badge_earned TEXT,
+                    description TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (referral_id) REFERENCES referrals (id)
+                )
+            ''')
+            
+            # Table des règles de parrainage (configuration admin)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rule_name TEXT UNIQUE NOT NULL,
+                    rule_value TEXT NOT NULL,
+                    description TEXT,
+                    updated_by INTEGER,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (updated_by) REFERENCES users (id)
+                )
+            ''')
+            
+            # Table des logs anti-triche
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_fraud_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip_address TEXT,
+                    device_fingerprint TEXT,
+                    email TEXT,
+                    referral_code TEXT,
+                    fraud_type TEXT,
+                    details TEXT,
+                    blocked BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Table des sources de confiance (IPs / appareils exemptés)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_allowlist (
+                    kind TEXT NOT NULL CHECK (kind IN ('ip', 'device')),
+                    value TEXT NOT NULL,
+                    description TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (kind, value)
+                )
+            ''')
+            
+            # Index pour les performances
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_code ON referrals(referral_code)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_status ON referrals(status)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referral_rewards_user ON referral_rewards(user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fraud_logs_ip ON referral_fraud_logs(ip_address)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fraud_logs_email ON referral_fraud_logs(email)')
+            
+            # Index composites pour les contrôles anti-triche et les statistiques
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_ip_status ON referrals(signup_ip, status)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_device_status ON referrals(signup_device_fingerprint, status)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer_status ON referrals(referrer_id, status) WHERE referee_id IS NOT NULL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_pending_referrer ON referrals(referrer_id) WHERE referee_id IS NULL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer_signup ON referrals(referrer_id, signup_date DESC) WHERE referee_id IS NOT NULL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_signup_keyset ON referrals(signup_date DESC, id DESC) WHERE referee_id IS NOT NULL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_status_signup ON referrals(status, signup_date DESC, id DESC) WHERE referee_id IS NOT NULL')
+            
+            # Statistiques agrégées par parrain
+            init_referral_stats(cursor)
+            
+            # Insertion des règles par défaut
+            default_rules = [
+                ('max_referrals_per_ip', '3', 'Nombre maximum de parrainages par IP'),
+                ('validation_requires_payment', 'true', 'Validation nécessite un paiement'),
+                ('validation_requires_email', 'true', 'Validation nécessite email vérifié'),
+                ('xp_signup', '5', 'XP par inscription'),
+                ('xp_validated', '25', 'XP par filleul validé'),
+                ('offer_duration_days', '30', 'Durée des offres en jours')
+            ]
+            
+            for rule_name, rule_value, description in default_rules:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO referral_rules (rule_name, rule_value, description)
+                    VALUES (?, ?, ?)
+                ''', (rule_name, rule_value, description))
+            
+            conn.commit()
+            
+            load_referral_allowlist(cursor)
+            
+            print("✅ Tables de parrainage initialisées")
+            
     except Exception as e:
         print(f"⚠️ Erreur lors de l'initialisation des tables de parrainage: {e}")
 
+def load_referral_allowlist(cursor):
+    """Charge en mémoire les IPs et appareils de confiance"""
+    global _trusted_ips, _trusted_devices
+    
+    cursor.execute('SELECT kind, value FROM referral_allowlist')
+    ips, devices = set(), set()
+    for kind, value in cursor.fetchall():
+        (ips if kind == 'ip' else devices).add(value)
+    
+    _trusted_ips = frozenset(ips)
+    _trusted_devices = frozenset(devices)
+
+@_safe
+def reload_referral_allowlist():
+    """Recharge la liste des sources de confiance après une modification admin"""
+    with get_connection() as conn:
+        load_referral_allowlist(conn.cursor())
+    
+    return {'success': True, 'ips': len(_trusted_ips), 'devices': len(_trusted_devices)}
+
+def init_referral_stats(cursor):
+    """Crée la table de statistiques matérialisées et les triggers qui la maintiennent"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'referral_stats'")
+    needs_backfill = cursor.fetchone() is None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referral_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_referrals INTEGER NOT NULL DEFAULT 0,
+            registered INTEGER NOT NULL DEFAULT 0,
+            validated INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            total_xp INTEGER NOT NULL DEFAULT 0,
+            last_reward_date DATETIME
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_referral_stats_ranking ON referral_stats(validated DESC, total_xp DESC)')
+    
+    # Un parrainage compte dès qu'un filleul y est associé (referee_id renseigné)
+    add_referral = '''
+        INSERT INTO referral_stats (user_id, total_referrals, registered, validated, blocked)
+        VALUES (NEW.referrer_id, 1, NEW.status = 'registered', NEW.status = 'validated', NEW.status = 'blocked')
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_referrals = total_referrals + 1,
+            registered = registered + excluded.registered,
+            validated = validated + excluded.validated,
+            blocked = blocked + excluded.blocked;
+    '''
+    remove_referral = '''
+        UPDATE referral_stats SET
+            total_referrals = total_referrals - 1,
+            registered = registered - (OLD.status = 'registered'),
+            validated = validated - (OLD.status = 'validated'),
+            blocked = blocked - (OLD.status = 'blocked')
+        WHERE user_id = OLD.referrer_id;
+    '''
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_insert
+        AFTER INSERT ON referrals WHEN NEW.referee_id IS NOT NULL
+        BEGIN {add_referral} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_update_old
+        AFTER UPDATE OF referrer_id, referee_id, status ON referrals WHEN OLD.referee_id IS NOT NULL
+        BEGIN {remove_referral} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_update_new
+        AFTER UPDATE OF referrer_id, referee_id, status ON referrals WHEN NEW.referee_id IS NOT NULL
+        BEGIN {add_referral} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_delete
+        AFTER DELETE ON referrals WHEN OLD.referee_id IS NOT NULL
+        BEGIN {remove_referral} END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_reward_insert
+        AFTER INSERT ON referral_rewards
+        BEGIN
+            INSERT INTO referral_stats (user_id, total_xp, last_reward_date)
+            VALUES (NEW.user_id, COALESCE(NEW.xp_amount, 0), NEW.created_at)
+            ON CONFLICT(user_id) DO UPDATE SET
+                total_xp = total_xp + excluded.total_xp,
+                last_reward_date = MAX(COALESCE(last_reward_date, ''), COALESCE(excluded.last_reward_date, ''));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_referral_stats_reward_delete
+        AFTER DELETE ON referral_rewards
+        BEGIN
+            UPDATE referral_stats SET total_xp = total_xp - COALESCE(OLD.xp_amount, 0)
+            WHERE user_id = OLD.user_id;
+        END
+    ''')
+    
+    # Remplissage initial à partir de l'historique existant
+    if needs_backfill:
+        cursor.execute('''
+            INSERT INTO referral_stats (user_id, total_referrals, registered, validated, blocked, total_xp, last_reward_date)
+            SELECT user_id, SUM(total_referrals), SUM(registered), SUM(validated), SUM(blocked), SUM(total_xp), MAX(last_reward_date)
+            FROM (
+                SELECT 
+                    referrer_id as user_id,
+                    COUNT(*) as total_referrals,
+                    SUM(CASE WHEN status = 'registered' THEN 1 ELSE 0 END) as registered,
+                    SUM(CASE WHEN status = 'validated' THEN 1 ELSE 0 END) as validated,
+                    SUM(CASE WHEN status = 'blocked' THEN 1 ELSE 0 END) as blocked,
+                    0 as total_xp,
+                    NULL as last_reward_date
+                FROM referrals
+                WHERE referee_id IS NOT NULL
+                GROUP BY referrer_id
+                UNION ALL
+                SELECT user_id, 0, 0, 0, 0, COALESCE(SUM(xp_amount), 0), MAX(created_at)
+                FROM referral_rewards
+                GROUP BY user_id
+            )
+            GROUP BY user_id
+        ''')
+
 # ============================================================================
 # GÉNÉRATION ET GESTION DES CODES DE PARRAINAGE
 # ============================================================================
 
+@_safe
 def generate_referral_code(user_id):
     """Génère un code de parrainage unique pour un utilisateur"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         # Vérification si l'utilisateur a déjà un code
@@ -170,7 +440,6 @@ def generate_referral_code(user_id):
         existing_code = cursor.fetchone()
         
         if existing_code:
-            conn.close()
             return {'success': True, 'code': existing_code[0], 'existing': True}
         
         # Génération d'un code unique
@@ -190,88 +459,67 @@ def generate_referral_code(user_id):
                 ''', (user_id, code_hash))
                 
                 conn.commit()
-                conn.close()
                 
                 return {'success': True, 'code': code_hash, 'existing': False}
             
             attempts += 1
         
-        conn.close()
         return {'success': False, 'error': 'Impossible de générer un code unique'}
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
 
+@_safe
 def get_referral_link(user_id, base_url="https://mindtraderpro.com"):
     """Génère le lien de parrainage complet pour un utilisateur"""
-    try:
-        code_result = generate_referral_code(user_id)
-        
-        if not code_result['success']:
-            return code_result
-        
-        referral_code = code_result['code']
-        referral_link = f"{base_url}/register?ref={referral_code}"
-        
-        return {
-            'success': True,
-            'code': referral_code,
-            'link': referral_link,
-            'existing': code_result.get('existing', False)
-        }
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
+    code_result = generate_referral_code(user_id)
+    
+    if not code_result['success']:
+        return code_result
+    
+    referral_code = code_result['code']
+    referral_link = f"{base_url}/register?ref={referral_code}"
+    
+    return {
+        'success': True,
+        'code': referral_code,
+        'link': referral_link,
+        'existing': code_result.get('existing', False)
+    }
 
 # ============================================================================
 # GESTION DES INSCRIPTIONS VIA PARRAINAGE
 # ============================================================================
 
+@_safe
 def process_referral_signup(referral_code, new_user_id, signup_ip, device_fingerprint, email):
     """Traite l'inscription d'un nouveau membre via parrainage"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
         
-        # Vérification de l'existence du code de parrainage
-        cursor.execute('''
-            SELECT id, referrer_id FROM referrals 
-            WHERE referral_code = ? AND referee_id IS NULL
-        ''', (referral_code,))
-        
-        referral_data = cursor.fetchone()
-        if not referral_data:
-            conn.close()
-            return {'success': False, 'error': 'Code de parrainage invalide'}
-        
-        referral_id, referrer_id = referral_data
-        
-        # Vérifications anti-triche
-        fraud_check = check_fraud_indicators(signup_ip, device_fingerprint, email, referral_code, cursor)
+        # Vérifications anti-triche (le log n'est écrit que si le code est valide)
+        fraud_check = check_fraud_indicators(signup_ip, device_fingerprint, email, referral_code, cursor, log_attempt=False)
         
         if fraud_check['blocked']:
-            conn.close()
+            cursor.execute('''
+                SELECT id FROM referrals 
+                WHERE referral_code = ? AND referee_id IS NULL
+            ''', (referral_code,))
+            if not cursor.fetchone():
+                return {'success': False, 'error': 'Code de parrainage invalide'}
+            
+            log_fraud_attempt(cursor, signup_ip, device_fingerprint, email, referral_code, fraud_check['reason'])
+            conn.commit()
             return {
                 'success': False, 
                 'error': 'Inscription bloquée pour suspicion de fraude',
                 'fraud_reason': fraud_check['reason']
             }
         
-        # Mise à jour du parrainage avec les informations du filleul
-        cursor.execute('''
-            UPDATE referrals 
-            SET referee_id = ?, signup_ip = ?, signup_device_fingerprint = ?, status = 'registered'
-            WHERE id = ?
-        ''', (new_user_id, signup_ip, device_fingerprint, referral_id))
-        
-        # Attribution de l'XP au parrain pour l'inscription
-        from modules.grade_manager import add_user_xp_with_notifications
-        xp_result = add_user_xp_with_notifications(
-            referrer_id, 
-            'referral_signup', 
-            REFERRAL_XP_REWARDS['signup'],
-            f'Parrainage: Inscription de #{new_user_id}'
-        )
+        # Attribution du code au filleul (vérification et mise à jour en une requête)
+        referral_data = claim_referral_code(cursor, referral_code, new_user_id, signup_ip, device_fingerprint)
+        if not referral_data:
+            return {'success': False, 'error': 'Code de parrainage invalide'}
+        
+        referral_id, referrer_id = referral_data
         
         # Enregistrement de la récompense
         cursor.execute('''
@@ -280,60 +528,98 @@ def process_referral_signup(referral_code, new_user_id, signup_ip, device_finger
         ''', (referrer_id, referral_id, REFERRAL_XP_REWARDS['signup']))
         
         conn.commit()
-        conn.close()
-        
-        return {
-            'success': True,
-            'referrer_id': referrer_id,
-            'referral_id': referral_id,
-            'xp_awarded': REFERRAL_XP_REWARDS['signup']
-        }
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
+    
+    invalidate_leaderboard_cache()
+    
+    # Attribution de l'XP au parrain pour l'inscription (hors transaction)
+    xp_result = add_user_xp_with_notifications(
+        referrer_id, 
+        'referral_signup', 
+        REFERRAL_XP_REWARDS['signup'],
+        f'Parrainage: Inscription de #{new_user_id}'
+    )
+    
+    return {
+        'success': True,
+        'referrer_id': referrer_id,
+        'referral_id': referral_id,
+        'xp_awarded': REFERRAL_XP_REWARDS['signup']
+    }
+
+def claim_referral_code(cursor, referral_code, new_user_id, signup_ip, device_fingerprint):
+    """Associe un code de parrainage libre au filleul, retourne (referral_id, referrer_id) ou None"""
+    if _SUPPORTS_RETURNING:
+        cursor.execute('''
+            UPDATE referrals 
+            SET referee_id = ?, signup_ip = ?, signup_device_fingerprint = ?, status = 'registered'
+            WHERE referral_code = ? AND referee_id IS NULL
+            RETURNING id, referrer_id
+        ''', (new_user_id, signup_ip, device_fingerprint, referral_code))
+        row = cursor.fetchone()
+        return (row['id'], row['referrer_id']) if row else None
+    
+    # SQLite < 3.35 : vérification puis mise à jour
+    cursor.execute('''
+        SELECT id, referrer_id FROM referrals 
+        WHERE referral_code = ? AND referee_id IS NULL
+    ''', (referral_code,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    
+    cursor.execute('''
+        UPDATE referrals 
+        SET referee_id = ?, signup_ip = ?, signup_device_fingerprint = ?, status = 'registered'
+        WHERE id = ?
+    ''', (new_user_id, signup_ip, device_fingerprint, row['id']))
+    return (row['id'], row['referrer_id'])
+
+def log_fraud_attempt(cursor, ip_address, device_fingerprint, email, referral_code, details):
+    """Enregistre une tentative de parrainage suspecte"""
+    cursor.execute('''
+        INSERT INTO referral_fraud_logs 
+        (ip_address, device_fingerprint, email, referral_code, fraud_type, details)
+        VALUES (?, ?, ?, ?, 'signup_fraud', ?)
+    ''', (ip_address, device_fingerprint, email, referral_code, details))
 
-def check_fraud_indicators(ip_address, device_fingerprint, email, referral_code, cursor):
+def check_fraud_indicators(ip_address, device_fingerprint, email, referral_code, cursor, log_attempt=True):
     """Vérifie les indicateurs de fraude pour un parrainage"""
     try:
         fraud_indicators = []
         
-        # Vérification des doublons d'IP
-        cursor.execute('''
-            SELECT COUNT(*) FROM referrals 
-            WHERE signup_ip = ? AND status != 'blocked'
-        ''', (ip_address,))
-        ip_count = cursor.fetchone()[0]
+        # Les sources de confiance ne sont pas comptées ; la requête est
+        # évitée quand ni l'IP ni l'appareil ne doivent être contrôlés
+        ip_to_check = None if ip_address in _trusted_ips else ip_address
+        device_to_check = None if device_fingerprint in _trusted_devices else device_fingerprint
+        
+        ip_count = device_count = 0
+        if ip_to_check or device_to_check:
+            # Vérification des doublons d'IP et d'empreinte d'appareil (une seule requête)
+            cursor.execute('''
+                SELECT 
+                    COALESCE(SUM(CASE WHEN signup_ip = ? THEN 1 ELSE 0 END), 0) as ip_count,
+                    COALESCE(SUM(CASE WHEN signup_device_fingerprint = ? THEN 1 ELSE 0 END), 0) as device_count
+                FROM referrals 
+                WHERE status != 'blocked' AND (signup_ip = ? OR signup_device_fingerprint = ?)
+            ''', (ip_to_check, device_to_check, ip_to_check, device_to_check))
+            ip_count, device_count = cursor.fetchone()
         
         if ip_count >= 3:  # Limite configurable
             fraud_indicators.append(f'Trop de parrainages depuis cette IP ({ip_count})')
         
-        # Vérification des doublons d'empreinte d'appareil
-        if device_fingerprint:
-            cursor.execute('''
-                SELECT COUNT(*) FROM referrals 
-                WHERE signup_device_fingerprint = ? AND status != 'blocked'
-            ''', (device_fingerprint,))
-            device_count = cursor.fetchone()[0]
-            
-            if device_count >= 2:
-                fraud_indicators.append(f'Appareil déjà utilisé ({device_count} fois)')
+        if device_fingerprint and device_count >= 2:
+            fraud_indicators.append(f'Appareil déjà utilisé ({device_count} fois)')
         
         # Vérification des doublons d'email (domaine temporaire, etc.)
         if email:
-            # Domaines suspects
-            suspicious_domains = ['10minutemail.com', 'mailinator.com', 'guerrillamail.com', 'tempmail.org']
-            email_domain = email.split('@')[-1].lower()
+            email_domain = email.rpartition('@')[2].lower()
             
-            if email_domain in suspicious_domains:
+            if email_domain in SUSPICIOUS_DOMAINS:
                 fraud_indicators.append(f'Email temporaire détecté: {email_domain}')
         
         # Enregistrement des tentatives suspectes
-        if fraud_indicators:
-            cursor.execute('''
-                INSERT INTO referral_fraud_logs 
-                (ip_address, device_fingerprint, email, referral_code, fraud_type, details)
-                VALUES (?, ?, ?, ?, 'signup_fraud', ?)
-            ''', (ip_address, device_fingerprint, email, referral_code, ' | '.join(fraud_indicators)))
+        if fraud_indicators and log_attempt:
+            log_fraud_attempt(cursor, ip_address, device_fingerprint, email, referral_code, ' | '.join(fraud_indicators))
         
         return {
             'blocked': len(fraud_indicators) > 0,
@@ -348,11 +634,12 @@ def check_fraud_indicators(ip_address, device_fingerprint, email, referral_code,
 # VALIDATION DES FILLEULS
 # ============================================================================
 
+@_safe
 def validate_referral(referral_id, validation_reason="Manuel"):
     """Valide un parrainage et attribue les récompenses finales"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
         
         # Récupération des informations du parrainage
         cursor.execute('''
@@ -362,13 +649,11 @@ def validate_referral(referral_id, validation_reason="Manuel"):
         
         referral_data = cursor.fetchone()
         if not referral_data:
-            conn.close()
             return {'success': False, 'error': 'Parrainage non trouvé'}
         
         referrer_id, referee_id, current_status = referral_data
         
         if current_status == 'validated':
-            conn.close()
             return {'success': False, 'error': 'Parrainage déjà validé'}
         
         # Mise à jour du statut
@@ -378,15 +663,6 @@ def validate_referral(referral_id, validation_reason="Manuel"):
             WHERE id = ?
         ''', (validation_reason, referral_id))
         
-        # Attribution de l'XP de validation au parrain
-        from modules.grade_manager import add_user_xp_with_notifications
-        xp_result = add_user_xp_with_notifications(
-            referrer_id, 
-            'referral_validated', 
-            REFERRAL_XP_REWARDS['validated'],
-            f'Parrainage validé: #{referee_id}'
-        )
-        
         # Vérification des badges de parrainage
         cursor.execute('''
             SELECT COUNT(*) FROM referrals 
@@ -394,11 +670,8 @@ def validate_referral(referral_id, validation_reason="Manuel"):
         ''', (referrer_id,))
         validated_count = cursor.fetchone()[0]
         
-        badge_earned = None
-        for threshold, badge_info in REFERRAL_BADGES.items():
-            if validated_count == threshold:
-                badge_earned = badge_info['name']
-                break
+        badge_info = REFERRAL_BADGES.get(validated_count)
+        badge_earned = badge_info['name'] if badge_info else None
         
         # Enregistrement de la récompense de validation
         cursor.execute('''
@@ -407,92 +680,227 @@ def validate_referral(referral_id, validation_reason="Manuel"):
         ''', (referrer_id, referral_id, REFERRAL_XP_REWARDS['validated'], badge_earned))
         
         conn.commit()
-        conn.close()
-        
-        return {
-            'success': True,
-            'xp_awarded': REFERRAL_XP_REWARDS['validated'],
-            'badge_earned': badge_earned,
-            'validated_count': validated_count
-        }
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
+    
+    invalidate_leaderboard_cache()
+    
+    # Attribution de l'XP de validation au parrain (hors transaction)
+    xp_result = add_user_xp_with_notifications(
+        referrer_id, 
+        'referral_validated', 
+        REFERRAL_XP_REWARDS['validated'],
+        f'Parrainage validé: #{referee_id}'
+    )
+    
+    return {
+        'success': True,
+        'xp_awarded': REFERRAL_XP_REWARDS['validated'],
+        'badge_earned': badge_earned,
+        'validated_count': validated_count
+    }
+
+_validation_rules_cache = {'rules': None, 'expires_at': 0.0}
+
+def get_validation_rules(cursor):
+    """Retourne les règles de validation (nom -> valeur), mises en cache quelques secondes"""
+    now = time.monotonic()
+    if _validation_rules_cache['rules'] is not None and now < _validation_rules_cache['expires_at']:
+        return _validation_rules_cache['rules']
+    
+    cursor.execute('''
+        SELECT rule_name, rule_value FROM referral_rules 
+        WHERE rule_name IN ('validation_requires_payment', 'validation_requires_email')
+    ''')
+    rules = dict(cursor.fetchall())
+    
+    _validation_rules_cache['rules'] = rules
+    _validation_rules_cache['expires_at'] = now + RULES_CACHE_TTL
+    return rules
+
+def invalidate_validation_rules_cache():
+    """Force le rechargement des règles de validation au prochain appel"""
+    _validation_rules_cache['rules'] = None
+
+_auto_validation_queue = queue.Queue()
+_auto_validation_thread = None
+_auto_validation_lock = threading.Lock()
 
 def check_auto_validation(user_id):
-    """Vérifie si un filleul peut être automatiquement validé"""
+    """Programme la vérification d'auto-validation d'un filleul
+    
+    Appelée depuis la vérification d'email ou le webhook de paiement : le
+    filleul est mis en file et traité par lot en arrière-plan. Le résultat de
+    la validation n'est donc pas connu au retour : {'can_validate': None, 'queued': True}.
+    Une demande perdue (arrêt ou recyclage du processus) est reprise par la
+    passe de rattrapage au démarrage ou par la passe périodique suivante.
+    """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        _auto_validation_queue.put(user_id)
+        _ensure_auto_validation_worker()
         
-        # Récupération des paramètres de validation
-        cursor.execute('''
-            SELECT rule_value FROM referral_rules 
-            WHERE rule_name IN ('validation_requires_payment', 'validation_requires_email')
-        ''')
-        rules = cursor.fetchall()
+        return {'can_validate': None, 'queued': True}
         
-        requires_payment = any(rule[0].lower() == 'true' for rule in rules if 'payment' in str(rule))
-        requires_email = any(rule[0].lower() == 'true' for rule in rules if 'email' in str(rule))
+    except Exception as e:
+        return {'can_validate': False, 'error': f'Erreur: {str(e)}'}
+
+def _ensure_auto_validation_worker():
+    """Démarre la boucle d'auto-validation si elle ne tourne pas déjà"""
+    global _auto_validation_thread
+    
+    with _auto_validation_lock:
+        if _auto_validation_thread is None or not _auto_validation_thread.is_alive():
+            _auto_validation_thread = threading.Thread(target=_auto_validation_worker, daemon=True)
+            _auto_validation_thread.start()
+
+def _auto_validation_worker():
+    """Boucle de fond : regroupe les demandes et lance une passe de validation
+    
+    Une passe de rattrapage sur tous les parrainages en attente est lancée au
+    démarrage puis toutes les AUTO_VALIDATION_RECOVERY_INTERVAL secondes.
+    """
+    next_recovery = time.monotonic()
+    
+    while True:
+        if time.monotonic() >= next_recovery:
+            result = run_pending_auto_validation_sweep()
+            if not result['success']:
+                print(f"⚠️ Erreur lors du rattrapage des auto-validations: {result['error']}")
+            next_recovery = time.monotonic() + AUTO_VALIDATION_RECOVERY_INTERVAL
+        
+        try:
+            user_ids = {_auto_validation_queue.get(timeout=max(0, next_recovery - time.monotonic()))}
+        except queue.Empty:
+            continue
+        
+        # Attente pour regrouper les webhooks arrivant en rafale
+        time.sleep(AUTO_VALIDATION_INTERVAL)
+        
+        while len(user_ids) < AUTO_VALIDATION_BATCH_SIZE:
+            try:
+                user_ids.add(_auto_validation_queue.get_nowait())
+            except queue.Empty:
+                break
         
-        # Vérification du statut utilisateur
+        result = run_auto_validation_sweep(user_ids)
+        if not result['success']:
+            print(f"⚠️ Erreur lors de l'auto-validation des parrainages: {result['error']}")
+            # Échec de la passe (base verrouillée...) : le lot est remis en file
+            for user_id in user_ids:
+                _auto_validation_queue.put(user_id)
+
+@_safe
+def run_pending_auto_validation_sweep():
+    """Passe de rattrapage : examine tous les filleuls dont le parrainage est en attente"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute('''
-            SELECT email_verified, has_made_payment FROM users WHERE id = ?
-        ''', (user_id,))
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            conn.close()
-            return {'can_validate': False, 'reason': 'Utilisateur non trouvé'}
-        
-        email_verified, has_made_payment = user_data
-        
-        # Vérification des conditions
-        validation_issues = []
-        
-        if requires_email and not email_verified:
-            validation_issues.append('Email non vérifié')
+            SELECT referee_id FROM referrals
+            WHERE status = 'registered' AND referee_id IS NOT NULL
+        ''')
+        pending = [row[0] for row in cursor.fetchall()]
+    
+    validated = []
+    for start in range(0, len(pending), AUTO_VALIDATION_BATCH_SIZE):
+        result = run_auto_validation_sweep(pending[start:start + AUTO_VALIDATION_BATCH_SIZE])
+        if not result['success']:
+            return result
+        validated.extend(result['validated'])
+    
+    return {'success': True, 'validated': validated}
+
+@_safe
+def run_auto_validation_sweep(user_ids):
+    """Valide en une transaction les parrainages des filleuls remplissant les conditions"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {'success': True, 'validated': []}
+    
+    validated = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
         
-        if requires_payment and not has_made_payment:
-            validation_issues.append('Aucun paiement effectué')
+        # Récupération des paramètres de validation
+        rules = get_validation_rules(cursor)
+        
+        requires_payment = rules.get('validation_requires_payment', '').lower() == 'true'
+        requires_email = rules.get('validation_requires_email', '').lower() == 'true'
+        
+        # Parrainages en attente dont le filleul remplit les conditions
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'''
+            SELECT r.id, r.referrer_id, r.referee_id FROM referrals r
+            JOIN users u ON u.id = r.referee_id
+            WHERE r.status = 'registered' AND r.referee_id IN ({placeholders})
+                AND (? OR u.email_verified = 1) AND (? OR u.has_made_payment = 1)
+            ORDER BY r.id
+        ''', (*user_ids, not requires_email, not requires_payment))
+        to_validate = cursor.fetchall()
+        
+        if not to_validate:
+            conn.rollback()
+            return {'success': True, 'validated': []}
+        
+        # Nombre de validations déjà acquises par parrain (pour les badges)
+        referrer_ids = list({row[1] for row in to_validate})
+        cursor.execute(f'''
+            SELECT referrer_id, COUNT(*) FROM referrals
+            WHERE status = 'validated' AND referrer_id IN ({','.join('?' * len(referrer_ids))})
+            GROUP BY referrer_id
+        ''', referrer_ids)
+        validated_counts = dict(cursor.fetchall())
+        
+        rewards = []
+        for referral_id, referrer_id, referee_id in to_validate:
+            validated_count = validated_counts.get(referrer_id, 0) + 1
+            validated_counts[referrer_id] = validated_count
+            
+            badge_info = REFERRAL_BADGES.get(validated_count)
+            badge_earned = badge_info['name'] if badge_info else None
+            
+            rewards.append((referrer_id, referral_id, REFERRAL_XP_REWARDS['validated'], badge_earned))
+            validated.append({
+                'referral_id': referral_id,
+                'referrer_id': referrer_id,
+                'referee_id': referee_id,
+                'badge_earned': badge_earned,
+                'validated_count': validated_count
+            })
         
-        can_validate = len(validation_issues) == 0
+        # Mise à jour des statuts et récompenses en lot
+        cursor.executemany('''
+            UPDATE referrals 
+            SET status = 'validated', validation_date = CURRENT_TIMESTAMP, validation_reason = 'Auto-validation'
+            WHERE id = ?
+        ''', [(row[0],) for row in to_validate])
         
-        # Auto-validation si possible
-        if can_validate:
-            cursor.execute('''
-                SELECT id FROM referrals 
-                WHERE referee_id = ? AND status = 'registered'
-            ''', (user_id,))
-            
-            referral_to_validate = cursor.fetchone()
-            if referral_to_validate:
-                validation_result = validate_referral(referral_to_validate[0], "Auto-validation")
-                conn.close()
-                return {
-                    'can_validate': True,
-                    'auto_validated': True,
-                    'validation_result': validation_result
-                }
-        
-        conn.close()
-        return {
-            'can_validate': can_validate,
-            'auto_validated': False,
-            'issues': validation_issues
-        }
+        cursor.executemany('''
+            INSERT INTO referral_rewards (user_id, referral_id, reward_type, xp_amount, badge_earned, description)
+            VALUES (?, ?, 'validation', ?, ?, 'XP pour parrainage validé')
+        ''', rewards)
         
-    except Exception as e:
-        return {'can_validate': False, 'error': f'Erreur: {str(e)}'}
+        conn.commit()
+    
+    invalidate_leaderboard_cache()
+    
+    # Attribution de l'XP de validation aux parrains (hors transaction)
+    for item in validated:
+        add_user_xp_with_notifications(
+            item['referrer_id'], 
+            'referral_validated', 
+            REFERRAL_XP_REWARDS['validated'],
+            f"Parrainage validé: #{item['referee_id']}"
+        )
+    
+    return {'success': True, 'validated': validated}
 
 # ============================================================================
 # STATISTIQUES ET INFORMATIONS DE PARRAINAGE
 # ============================================================================
 
+@_safe
 def get_user_referral_stats(user_id):
     """Récupère les statistiques de parrainage d'un utilisateur"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         # Code de parrainage de l'utilisateur
@@ -501,47 +909,36 @@ def get_user_referral_stats(user_id):
             WHERE referrer_id = ? AND referee_id IS NULL
         ''', (user_id,))
         referral_code_result = cursor.fetchone()
-        referral_code = referral_code_result[0] if referral_code_result else None
+        referral_code = referral_code_result['referral_code'] if referral_code_result else None
         
-        # Statistiques de base
+        # Statistiques de base et XP total (table matérialisée)
         cursor.execute('''
-            SELECT 
-                COUNT(*) as total_referrals,
-                SUM(CASE WHEN status = 'registered' THEN 1 ELSE 0 END) as registered,
-                SUM(CASE WHEN status = 'validated' THEN 1 ELSE 0 END) as validated,
-                SUM(CASE WHEN status = 'blocked' THEN 1 ELSE 0 END) as blocked
-            FROM referrals 
-            WHERE referrer_id = ? AND referee_id IS NOT NULL
+            SELECT total_referrals, registered, validated, blocked, total_xp
+            FROM referral_stats 
+            WHERE user_id = ?
         ''', (user_id,))
         
         stats = cursor.fetchone()
-        
-        # XP total gagné via parrainage
-        cursor.execute('''
-            SELECT SUM(xp_amount) FROM referral_rewards 
-            WHERE user_id = ?
-        ''', (user_id,))
-        total_xp_result = cursor.fetchone()
-        total_xp = total_xp_result[0] or 0
+        total_xp = stats['total_xp'] if stats else 0
         
         # Badges débloqués
         cursor.execute('''
             SELECT DISTINCT badge_earned FROM referral_rewards 
             WHERE user_id = ? AND badge_earned IS NOT NULL
         ''', (user_id,))
-        badges = [row[0] for row in cursor.fetchall()]
+        badges = [row['badge_earned'] for row in cursor.fetchall()]
         
         # Prochain badge
-        validated_count = stats[2] if stats else 0
+        validated_count = stats['validated'] if stats else 0
         next_badge = None
-        for threshold, badge_info in REFERRAL_BADGES.items():
-            if validated_count < threshold:
-                next_badge = {
-                    'threshold': threshold,
-                    'name': badge_info['name'],
-                    'remaining': threshold - validated_count
-                }
-                break
+        index = bisect.bisect_right(_BADGE_THRESHOLDS, validated_count)
+        if index < len(_BADGE_THRESHOLDS):
+            threshold = _BADGE_THRESHOLDS[index]
+            next_badge = {
+                'threshold': threshold,
+                'name': REFERRAL_BADGES[threshold]['name'],
+                'remaining': threshold - validated_count
+            }
         
         # Liste des filleuls récents
         cursor.execute('''
@@ -553,103 +950,102 @@ def get_user_referral_stats(user_id):
             LIMIT 10
         ''', (user_id,))
         
-        recent_referrals = []
-        for row in cursor.fetchall():
-            recent_referrals.append({
-                'referee_id': row[0],
-                'username': row[1] or 'Utilisateur inconnu',
-                'status': row[2],
-                'signup_date': row[3],
-                'validation_date': row[4]
-            })
-        
-        conn.close()
+        recent_referrals = [dict(row) for row in cursor.fetchall()]
+        for referral in recent_referrals:
+            referral['username'] = referral['username'] or 'Utilisateur inconnu'
         
         return {
             'success': True,
             'referral_code': referral_code,
             'stats': {
-                'total_referrals': stats[0] if stats else 0,
-                'registered': stats[1] if stats else 0,
-                'validated': stats[2] if stats else 0,
-                'blocked': stats[3] if stats else 0
+                'total_referrals': stats['total_referrals'] if stats else 0,
+                'registered': stats['registered'] if stats else 0,
+                'validated': stats['validated'] if stats else 0,
+                'blocked': stats['blocked'] if stats else 0
             },
             'total_xp': total_xp,
             'badges': badges,
             'next_badge': next_badge,
             'recent_referrals': recent_referrals
         }
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
 
+_leaderboard_cache = {}  # limit -> (instant monotone, résultat)
+
+def invalidate_leaderboard_cache():
+    """Vide le cache du leaderboard après une modification des parrainages"""
+    _leaderboard_cache.clear()
+
+@_safe
 def get_referral_leaderboard(limit=20):
     """Récupère le leaderboard des meilleurs parrains"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    cached = _leaderboard_cache.get(limit)
+    if cached and time.monotonic() - cached[0] < LEADERBOARD_CACHE_TTL:
+        return cached[1]
+    
+    with get_connection() as conn:
         cursor = conn.cursor()
         
+        # Lecture de la table matérialisée, triée via idx_referral_stats_ranking
         cursor.execute('''
             SELECT 
                 u.id, u.username, u.role,
-                COUNT(r.id) as total_referrals,
-                SUM(CASE WHEN r.status = 'validated' THEN 1 ELSE 0 END) as validated_referrals,
-                COALESCE(SUM(rr.xp_amount), 0) as total_xp_earned,
-                MAX(rr.created_at) as last_reward_date
-            FROM users u
-            LEFT JOIN referrals r ON u.id = r.referrer_id AND r.referee_id IS NOT NULL
-            LEFT JOIN referral_rewards rr ON u.id = rr.user_id
-            GROUP BY u.id, u.username, u.role
-            HAVING total_referrals > 0
-            ORDER BY validated_referrals DESC, total_xp_earned DESC
+                s.total_referrals,
+                s.validated as validated_referrals,
+                s.total_xp as total_xp_earned,
+                s.last_reward_date
+            FROM referral_stats s
+            JOIN users u ON u.id = s.user_id
+            WHERE s.total_referrals > 0
+            ORDER BY s.validated DESC, s.total_xp DESC
             LIMIT ?
         ''', (limit,))
         
         leaderboard = []
         for i, row in enumerate(cursor.fetchall(), 1):
-            # Détermination du badge actuel
-            validated_count = row[4]
-            current_badge = None
-            for threshold, badge_info in sorted(REFERRAL_BADGES.items(), reverse=True):
-                if validated_count >= threshold:
-                    current_badge = badge_info
-                    break
-            
             leaderboard.append({
                 'rank': i,
-                'user_id': row[0],
-                'username': row[1],
-                'role': row[2],
-                'total_referrals': row[3],
-                'validated_referrals': row[4],
-                'total_xp_earned': row[5],
-                'last_reward_date': row[6],
-                'current_badge': current_badge
+                'user_id': row['id'],
+                'username': row['username'],
+                'role': row['role'],
+                'total_referrals': row['total_referrals'],
+                'validated_referrals': row['validated_referrals'],
+                'total_xp_earned': row['total_xp_earned'],
+                'last_reward_date': row['last_reward_date'],
+                'current_badge': get_current_badge(row['validated_referrals'])
             })
         
-        conn.close()
+        result = {'success': True, 'leaderboard': leaderboard}
+        _leaderboard_cache[limit] = (time.monotonic(), result)
         
-        return {'success': True, 'leaderboard': leaderboard}
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
+        return result
 
 # ============================================================================
 # ADMINISTRATION DU SYSTÈME DE PARRAINAGE
 # ============================================================================
 
-def get_all_referrals_admin(limit=50, offset=0, status_filter=None):
-    """Récupère tous les parrainages pour l'administration"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+@_safe
+def get_all_referrals_admin(limit=50, cursor_signup_date=None, cursor_id=None, status_filter=None):
+    """Récupère les parrainages pour l'administration (pagination par curseur)
+    
+    Le curseur (signup_date, id) est celui renvoyé dans 'next_cursor' par la
+    page précédente ; sans curseur, la première page est renvoyée.
+    """
+    with get_connection() as conn:
         cursor = conn.cursor()
         
-        query = '''
+        keyset = cursor_signup_date is not None and cursor_id is not None
+        
+        # Sur la première page, le total est projeté dans la même requête ;
+        # après un curseur, la fenêtre ne compterait que les lignes restantes
+        window_count = _SUPPORTS_WINDOW and not keyset
+        
+        query = f'''
             SELECT 
                 r.id, r.referral_code, r.status, r.signup_date, r.validation_date,
                 ur.username as referrer_username, ur.role as referrer_role,
                 uf.username as referee_username, uf.email as referee_email,
                 r.signup_ip, r.payment_made, r.email_verified
+                {', COUNT(*) OVER () AS total_count' if window_count else ''}
             FROM referrals r
             LEFT JOIN users ur ON r.referrer_id = ur.id
             LEFT JOIN users uf ON r.referee_id = uf.id
@@ -661,67 +1057,69 @@ def get_all_referrals_admin(limit=50, offset=0, status_filter=None):
             query += ' AND r.status = ?'
             params.append(status_filter)
         
-        query += ' ORDER BY r.signup_date DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
+        # Keyset : reprise après la dernière ligne de la page précédente
+        if keyset:
+            query += ' AND (r.signup_date, r.id) < (?, ?)'
+            params.extend([cursor_signup_date, cursor_id])
         
-        cursor.execute(query, params)
-        referrals = cursor.fetchall()
-        
-        # Comptage total
-        count_query = '''
-            SELECT COUNT(*) FROM referrals r 
-            WHERE r.referee_id IS NOT NULL
-        '''
-        count_params = []
-        
-        if status_filter:
-            count_query += ' AND r.status = ?'
-            count_params.append(status_filter)
-        
-        cursor.execute(count_query, count_params)
-        total_count = cursor.fetchone()[0]
-        
-        conn.close()
+        # Une ligne de plus que demandé pour savoir s'il reste une page
+        query += ' ORDER BY r.signup_date DESC, r.id DESC LIMIT ?'
+        params.append(limit + 1)
         
+        cursor.execute(query, params)
         referral_list = []
-        for row in referrals:
-            referral_list.append({
-                'id': row[0],
-                'referral_code': row[1],
-                'status': row[2],
-                'signup_date': row[3],
-                'validation_date': row[4],
-                'referrer_username': row[5],
-                'referrer_role': row[6],
-                'referee_username': row[7],
-                'referee_email': row[8],
-                'signup_ip': row[9],
-                'payment_made': bool(row[10]),
-                'email_verified': bool(row[11])
-            })
+        total_count = 0
+        for referral in _iter_rows(cursor):
+            if window_count:
+                total_count = referral.pop('total_count')
+            referral['payment_made'] = bool(referral['payment_made'])
+            referral['email_verified'] = bool(referral['email_verified'])
+            referral_list.append(referral)
+        
+        has_more = len(referral_list) > limit
+        if has_more:
+            referral_list.pop()
+        
+        next_cursor = None
+        if has_more:
+            last = referral_list[-1]
+            next_cursor = (last['signup_date'], last['id'])
+        
+        # Comptage total séparé (pages suivantes ou SQLite < 3.25)
+        if not window_count:
+            count_query = '''
+                SELECT COUNT(*) FROM referrals r 
+                WHERE r.referee_id IS NOT NULL
+            '''
+            count_params = []
+            
+            if status_filter:
+                count_query += ' AND r.status = ?'
+                count_params.append(status_filter)
+            
+            cursor.execute(count_query, count_params)
+            total_count = cursor.fetchone()[0]
         
         return {
             'success': True,
             'referrals': referral_list,
             'total_count': total_count,
-            'has_more': offset + limit < total_count
+            'has_more': has_more,
+            'next_cursor': next_cursor
         }
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
 
+@_safe
 def update_referral_status_admin(referral_id, new_status, admin_id, reason):
     """Met à jour le statut d'un parrainage (admin)"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
         
         # Vérification de l'existence du parrainage
         cursor.execute('SELECT status FROM referrals WHERE id = ?', (referral_id,))
         current_status_result = cursor.fetchone()
         
         if not current_status_result:
-            conn.close()
             return {'success': False, 'error': 'Parrainage non trouvé'}
         
         current_status = current_status_result[0]
@@ -741,17 +1139,15 @@ def update_referral_status_admin(referral_id, new_status, admin_id, reason):
         ''', (admin_id, referral_id, f"Statut changé: {current_status} → {new_status}. Raison: {reason}"))
         
         conn.commit()
-        conn.close()
         
-        return {'success': True, 'old_status': current_status, 'new_status': new_status}
+        invalidate_leaderboard_cache()
         
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
+        return {'success': True, 'old_status': current_status, 'new_status': new_status}
 
+@_safe
 def get_referral_fraud_logs(limit=100):
     """Récupère les logs de fraude pour l'administration"""
-    try:
-        conn = sqlite3.connect(DATABASE)
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -761,28 +1157,16 @@ def get_referral_fraud_logs(limit=100):
             LIMIT ?
         ''', (limit,))
         
-        logs = []
-        for row in cursor.fetchall():
-            logs.append({
-                'ip_address': row[0],
-                'device_fingerprint': row[1],
-                'email': row[2],
-                'referral_code': row[3],
-                'fraud_type': row[4],
-                'details': row[5],
-                'created_at': row[6]
-            })
-        
-        conn.close()
+        logs = list(_iter_rows(cursor))
         
         return {'success': True, 'fraud_logs': logs}
-        
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur: {str(e)}'}
 
 # ============================================================================
 # INITIALISATION AUTOMATIQUE
 # ============================================================================
 
 # Initialisation automatique des tables
-init_referral_tables()
\ No newline at end of file
+init_referral_tables()
+
+# Rattrapage des auto-validations en attente (demandes perdues avant un redémarrage)
+_ensure_auto_validation_worker()
\ No newline at end of file
@@ -2,11 +2,25 @@
 Système de Parrainage - Réductions progressives et fonctionnalités exclusives
 """
 import json
+from collections import Counter
+from operator import attrgetter
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 import uuid
+import time
+import bisect
+import heapq
+import secrets
+import string
+
+# Alphabet des suffixes aléatoires des codes automatiques
+CODE_SUFFIX_ALPHABET = string.ascii_uppercase + string.digits
+CODE_SUFFIX_LENGTH = 4
+
+# Extraction du statut d'un parrainage (comptages par statut)
+_get_status = attrgetter('status')
 
 class ReferralTier(Enum):
     BRONZE = "bronze"
@@ -22,7 +36,12 @@ class ReferralStatus(Enum):
     PREMIUM_CONVERTED = "premium_converted"
     CHURNED = "churned"
 
-@dataclass
+# Valeurs des enums précalculées : évite le descripteur Enum.value à chaque
+# sérialisation (les chaînes littérales sont déjà internées par CPython)
+_TIER_VALUES = {tier: tier.value for tier in ReferralTier}
+_STATUS_VALUES = {status: status.value for status in ReferralStatus}
+
+@dataclass(slots=True)
 class ReferralReward:
     """Récompense de parrainage"""
     reward_id: str
@@ -49,7 +68,7 @@ class ReferralReward:
     description: str
     icon: str
 
-@dataclass
+@dataclass(slots=True)
 class ReferralCode:
     """Code de parrainage"""
     code: str
@@ -60,8 +79,11 @@ class ReferralCode:
     usage_count: int
     is_active: bool
     custom_message: Optional[str]
+    
+    # Représentation mise en cache une fois le code désactivé
+    _cached_dict: Optional[Dict] = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class Referral:
     """Parrainage effectué"""
     referral_id: str
@@ -82,8 +104,11 @@ class Referral:
     referrer_ip: Optional[str]
     referred_ip: Optional[str]
     source: str  # web, mobile, social
+    
+    # Représentation mise en cache une fois le statut définitif
+    _cached_dict: Optional[Dict] = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class ReferralStats:
     """Statistiques de parrainage"""
     user_session: str
@@ -118,6 +143,8 @@ class ReferralSystem:
         self.user_codes = {}  # user_session -> List[ReferralCode]
         self.referrals = {}  # user_session -> List[Referral]
         self.referral_stats = {}  # user_session -> ReferralStats
+        self.referred_index: Dict[str, Referral] = {}  # referred_session -> Referral
+        self.counters: Dict[str, Dict[str, int]] = {}  # user_session -> total/confirmed/premium
         
         # Initialiser les tiers et récompenses
         self._init_referral_tiers()
@@ -234,6 +261,15 @@ class ReferralSystem:
                 icon="👑"
             )
         }
+        
+        # Seuils triés et tiers correspondants pour la recherche dichotomique
+        ordered = sorted(self.referral_tiers.values(), key=lambda r: r.min_referrals)
+        self._tier_thresholds = [r.min_referrals for r in ordered]
+        self._tier_by_index = [r.tier for r in ordered]
+        
+        # Représentations des tiers (immuables) sérialisées une seule fois
+        self._tier_dict_cache: Dict[ReferralTier, Dict] = {t: self._tier_reward_to_dict(r) for t, r in self.referral_tiers.items()}
+        self._all_tiers_dict_list = list(self._tier_dict_cache.values())
     
     def generate_referral_code(self, user_session: str, custom_code: Optional[str] = None, custom_message: Optional[str] = None) -> Dict:
         """Génère un code de parrainage pour un utilisateur"""
@@ -249,11 +285,19 @@ class ReferralSystem:
         else:
             # Code automatique basé sur l'utilisateur
             base_code = f"TC{user_session[-4:].upper()}"
-            counter = 1
             code = base_code
+            
+            # Suffixe aléatoire en cas de collision plutôt qu'un compteur séquentiel
+            attempts = 0
             while code in self.referral_codes:
-                code = f"{base_code}{counter}"
-                counter += 1
+                if attempts >= 8:
+                    return {
+                        'success': False,
+                        'error': 'Impossible de générer un code unique'
+                    }
+                suffix = ''.join(secrets.choice(CODE_SUFFIX_ALPHABET) for _ in range(CODE_SUFFIX_LENGTH))
+                code = f"{base_code}{suffix}"
+                attempts += 1
         
         # Créer le code de parrainage
         referral_code = ReferralCode(
@@ -313,27 +357,22 @@ class ReferralSystem:
             }
         
         # Vérifier si l'utilisateur a déjà été parrainé
-        existing_referrals = []
-        for referrals_list in self.referrals.values():
-            for ref in referrals_list:
-                if ref.referred_session == referred_user_session:
-                    existing_referrals.append(ref)
-        
-        if existing_referrals:
+        if referred_user_session in self.referred_index:
             return {
                 'success': False,
                 'error': 'Cet utilisateur a déjà été parrainé'
             }
         
         # Créer le parrainage
-        referral_id = f"ref_{int(datetime.now().timestamp())}_{referred_user_session}"
+        now = datetime.now()
+        referral_id = f"ref_{time.time_ns()}_{referred_user_session}"
         
         referral = Referral(
             referral_id=referral_id,
             referrer_session=code_obj.user_session,
             referred_session=referred_user_session,
             referral_code=referral_code.upper(),
-            referred_at=datetime.now(),
+            referred_at=now,
             confirmed_at=None,
             premium_converted_at=None,
             status=ReferralStatus.PENDING,
@@ -344,9 +383,12 @@ class ReferralSystem:
         )
         
         # Sauvegarder le parrainage
+        counters = self._get_counters(code_obj.user_session)
         if code_obj.user_session not in self.referrals:
             self.referrals[code_obj.user_session] = []
         self.referrals[code_obj.user_session].append(referral)
+        self.referred_index[referred_user_session] = referral
+        counters['total'] += 1
         
         # Mettre à jour le compteur d'usage
         code_obj.usage_count += 1
@@ -363,33 +405,28 @@ class ReferralSystem:
         """Confirme un parrainage (quand l'utilisateur s'inscrit vraiment)"""
         
         # Trouver le parrainage en attente
-        referral = None
-        referrer_session = None
-        
-        for user_session, referrals_list in self.referrals.items():
-            for ref in referrals_list:
-                if ref.referred_session == referred_user_session and ref.status == ReferralStatus.PENDING:
-                    referral = ref
-                    referrer_session = user_session
-                    break
-            if referral:
-                break
-        
-        if not referral:
+        referral = self.referred_index.get(referred_user_session)
+        
+        if not referral or referral.status != ReferralStatus.PENDING:
             return {
                 'success': False,
                 'error': 'Aucun parrainage en attente trouvé'
             }
         
+        referrer_session = referral.referrer_session
+        
         # Confirmer le parrainage
+        counters = self._get_counters(referrer_session)
         referral.status = ReferralStatus.CONFIRMED
-        referral.confirmed_at = datetime.now()
+        now = datetime.now()
+        referral.confirmed_at = now
+        counters['confirmed'] += 1
         
         # Mettre à jour les statistiques du parrain
-        self._update_referrer_stats(referrer_session)
+        self._update_referrer_stats(referrer_session, now)
         
         # Vérifier les nouvelles récompenses débloquées
-        rewards_unlocked = self._check_tier_upgrades(referrer_session)
+        rewards_unlocked = self._check_tier_upgrades(referrer_session, now)
         
         return {
             'success': True,
@@ -402,27 +439,22 @@ class ReferralSystem:
         """Marque qu'un filleul est passé premium"""
         
         # Trouver le parrainage confirmé
-        referral = None
-        referrer_session = None
-        
-        for user_session, referrals_list in self.referrals.items():
-            for ref in referrals_list:
-                if ref.referred_session == referred_user_session and ref.status == ReferralStatus.CONFIRMED:
-                    referral = ref
-                    referrer_session = user_session
-                    break
-            if referral:
-                break
-        
-        if not referral:
+        referral = self.referred_index.get(referred_user_session)
+        
+        if not referral or referral.status != ReferralStatus.CONFIRMED:
             return {
                 'success': False,
                 'error': 'Aucun parrainage confirmé trouvé'
             }
         
-        # Marquer comme converti premium
+        referrer_session = referral.referrer_session
+        
+        # Marquer comme converti premium (reste compté comme confirmé)
+        counters = self._get_counters(referrer_session)
         referral.status = ReferralStatus.PREMIUM_CONVERTED
-        referral.premium_converted_at = datetime.now()
+        now = datetime.now()
+        referral.premium_converted_at = now
+        counters['premium'] += 1
         
         # Bonus spécial pour conversion premium
         bonus_reward = {
@@ -432,7 +464,7 @@ class ReferralSystem:
         }
         
         # Mettre à jour les stats
-        self._update_referrer_stats(referrer_session)
+        self._update_referrer_stats(referrer_session, now)
         
         return {
             'success': True,
@@ -444,9 +476,11 @@ class ReferralSystem:
     def get_referral_dashboard(self, user_session: str) -> Dict:
         """Récupère le tableau de bord de parrainage"""
         
+        now = datetime.now()
+        
         # Récupérer ou créer les statistiques
         if user_session not in self.referral_stats:
-            self._update_referrer_stats(user_session)
+            self._update_referrer_stats(user_session, now)
         
         stats = self.referral_stats.get(user_session)
         if not stats:
@@ -465,7 +499,7 @@ class ReferralSystem:
                 current_monthly_discount=0.0,
                 unlocked_features=[],
                 earned_rewards=[],
-                last_updated=datetime.now()
+                last_updated=now
             )
             self.referral_stats[user_session] = stats
         
@@ -475,55 +509,37 @@ class ReferralSystem:
         # Récupérer les parrainages
         user_referrals = self.referrals.get(user_session, [])
         
-        # Informations sur le tier actuel et suivant
-        current_tier_info = None
-        next_tier_info = None
-        
-        if stats.current_tier:
-            current_tier_info = self.referral_tiers[stats.current_tier]
-        
-        if stats.next_tier:
-            next_tier_info = self.referral_tiers[stats.next_tier]
-        
         return {
             'success': True,
             'stats': self._stats_to_dict(stats),
-            'current_tier': self._tier_reward_to_dict(current_tier_info) if current_tier_info else None,
-            'next_tier': self._tier_reward_to_dict(next_tier_info) if next_tier_info else None,
+            'current_tier': self._tier_dict_cache[stats.current_tier] if stats.current_tier else None,
+            'next_tier': self._tier_dict_cache[stats.next_tier] if stats.next_tier else None,
             'referral_codes': [self._code_to_dict(code) for code in user_codes],
             'recent_referrals': [self._referral_to_dict(ref) for ref in user_referrals[-5:]],
-            'all_tiers': [self._tier_reward_to_dict(tier) for tier in self.referral_tiers.values()]
+            'all_tiers': self._all_tiers_dict_list
         }
     
-    def _update_referrer_stats(self, user_session: str):
+    def _update_referrer_stats(self, user_session: str, now: Optional[datetime] = None):
         """Met à jour les statistiques d'un parrain"""
         
-        # Compter les parrainages
-        user_referrals = self.referrals.get(user_session, [])
+        # Compteurs maintenus à chaque changement de statut
+        counters = self._get_counters(user_session)
         
-        total_referrals = len(user_referrals)
-        confirmed_referrals = len([r for r in user_referrals if r.status in [ReferralStatus.CONFIRMED, ReferralStatus.PREMIUM_CONVERTED]])
-        premium_conversions = len([r for r in user_referrals if r.status == ReferralStatus.PREMIUM_CONVERTED])
-        active_referrals = len([r for r in user_referrals if r.status in [ReferralStatus.CONFIRMED, ReferralStatus.PREMIUM_CONVERTED]])
+        total_referrals = counters['total']
+        confirmed_referrals = counters['confirmed']
+        premium_conversions = counters['premium']
+        active_referrals = confirmed_referrals
         
-        # Déterminer le tier actuel
-        current_tier = None
-        for tier in reversed(list(ReferralTier)):
-            if confirmed_referrals >= self.referral_tiers[tier].min_referrals:
-                current_tier = tier
-                break
+        # Déterminer le tier actuel et le suivant (index dans la table des seuils)
+        i = bisect.bisect_right(self._tier_thresholds, confirmed_referrals) - 1
+        current_tier = self._tier_by_index[i] if i >= 0 else None
         
-        # Déterminer le tier suivant
         next_tier = None
         referrals_to_next = 0
         
-        for tier in ReferralTier:
-            if tier.value != current_tier.value if current_tier else True:
-                tier_requirement = self.referral_tiers[tier].min_referrals
-                if confirmed_referrals < tier_requirement:
-                    next_tier = tier
-                    referrals_to_next = tier_requirement - confirmed_referrals
-                    break
+        if i + 1 < len(self._tier_by_index):
+            next_tier = self._tier_by_index[i + 1]
+            referrals_to_next = self._tier_thresholds[i + 1] - confirmed_referrals
         
         # Calculer les économies
         current_discount = 0.0
@@ -562,16 +578,40 @@ class ReferralSystem:
             current_monthly_discount=current_discount,
             unlocked_features=unlocked_features,
             earned_rewards=earned_rewards,
-            last_updated=datetime.now()
+            last_updated=now or datetime.now()
         )
         
         self.referral_stats[user_session] = stats
     
-    def _check_tier_upgrades(self, user_session: str) -> List[Dict]:
+    def _get_counters(self, user_session: str) -> Dict[str, int]:
+        """Récupère les compteurs d'un parrain, reconstruits si absents"""
+        counters = self.counters.get(user_session)
+        if counters is None:
+            counters = self._rebuild_counters(user_session)
+        return counters
+    
+    def _rebuild_counters(self, user_session: str) -> Dict[str, int]:
+        """Recalcule les compteurs depuis la liste des parrainages (démarrage à froid, import)"""
+        user_referrals = self.referrals.get(user_session, [])
+        
+        # Comptage par statut entièrement en C (map + attrgetter + Counter)
+        by_status = Counter(map(_get_status, user_referrals))
+        premium = by_status[ReferralStatus.PREMIUM_CONVERTED]
+        
+        counters = {
+            'total': len(user_referrals),
+            'confirmed': by_status[ReferralStatus.CONFIRMED] + premium,
+            'premium': premium
+        }
+        
+        self.counters[user_session] = counters
+        return counters
+    
+    def _check_tier_upgrades(self, user_session: str, now: Optional[datetime] = None) -> List[Dict]:
         """Vérifie si de nouvelles récompenses sont débloquées"""
         
         previous_stats = self.referral_stats.get(user_session)
-        self._update_referrer_stats(user_session)
+        self._update_referrer_stats(user_session, now)
         new_stats = self.referral_stats[user_session]
         
         rewards_unlocked = []
@@ -582,7 +622,7 @@ class ReferralSystem:
                 tier_reward = self.referral_tiers[new_stats.current_tier]
                 rewards_unlocked.append({
                     'type': 'tier_upgrade',
-                    'tier': tier_reward.tier.value,
+                    'tier': _TIER_VALUES[tier_reward.tier],
                     'name': tier_reward.name,
                     'badge': tier_reward.special_badge,
                     'discount': tier_reward.discount_percent,
@@ -594,18 +634,18 @@ class ReferralSystem:
     
     def _get_confirmed_referrals_count(self, user_session: str) -> int:
         """Compte les parrainages confirmés"""
-        user_referrals = self.referrals.get(user_session, [])
-        return len([r for r in user_referrals if r.status in [ReferralStatus.CONFIRMED, ReferralStatus.PREMIUM_CONVERTED]])
+        return self._get_counters(user_session)['confirmed']
+    
+    def _resolve_tier(self, confirmed_count: int) -> Optional[ReferralTier]:
+        """Retourne le tier atteint pour un nombre de parrainages confirmés"""
+        i = bisect.bisect_right(self._tier_thresholds, confirmed_count) - 1
+        return self._tier_by_index[i] if i >= 0 else None
     
     def _get_user_tier_title(self, user_session: str) -> str:
         """Récupère le titre du tier d'un utilisateur"""
-        confirmed_count = self._get_confirmed_referrals_count(user_session)
-        
-        for tier in reversed(list(ReferralTier)):
-            if confirmed_count >= self.referral_tiers[tier].min_referrals:
-                return self.referral_tiers[tier].custom_title
+        tier = self._resolve_tier(self._get_confirmed_referrals_count(user_session))
         
-        return "Trader"
+        return self.referral_tiers[tier].custom_title if tier else "Trader"
     
     def get_user_discount_rate(self, user_session: str) -> float:
         """Récupère le taux de réduction actuel d'un utilisateur"""
@@ -613,50 +653,48 @@ class ReferralSystem:
         if user_session in self.referral_stats:
             return self.referral_stats[user_session].current_monthly_discount
         
-        confirmed_count = self._get_confirmed_referrals_count(user_session)
-        
-        for tier in reversed(list(ReferralTier)):
-            if confirmed_count >= self.referral_tiers[tier].min_referrals:
-                return self.referral_tiers[tier].discount_percent
+        tier = self._resolve_tier(self._get_confirmed_referrals_count(user_session))
         
-        return 0.0
+        return self.referral_tiers[tier].discount_percent if tier else 0.0
     
     def has_lifetime_access(self, user_session: str) -> bool:
         """Vérifie si l'utilisateur a accès à vie"""
         
         confirmed_count = self._get_confirmed_referrals_count(user_session)
-        legendary_tier = self.referral_tiers[ReferralTier.LEGENDARY]
         
-        return confirmed_count >= legendary_tier.min_referrals
+        # Le tier le plus élevé (Legendary) débloque l'accès à vie
+        return confirmed_count >= self._tier_thresholds[-1]
     
     def get_leaderboard(self, limit: int = 10) -> List[Dict]:
         """Récupère le classement des meilleurs parrains"""
         
-        leaderboard = []
-        
-        for user_session, referrals_list in self.referrals.items():
-            confirmed_count = len([r for r in referrals_list if r.status in [ReferralStatus.CONFIRMED, ReferralStatus.PREMIUM_CONVERTED]])
-            premium_count = len([r for r in referrals_list if r.status == ReferralStatus.PREMIUM_CONVERTED])
-            
-            if confirmed_count > 0:
-                tier_title = self._get_user_tier_title(user_session)
-                
-                leaderboard.append({
-                    'user_id': user_session[:8] + "...",  # Anonymisé
-                    'tier_title': tier_title,
-                    'confirmed_referrals': confirmed_count,
-                    'premium_conversions': premium_count,
-                    'success_rate': (premium_count / confirmed_count * 100) if confirmed_count > 0 else 0
-                })
-        
-        # Trier par nombre de parrainages confirmés
-        leaderboard.sort(key=lambda x: x['confirmed_referrals'], reverse=True)
+        # Compteurs manquants (parrainages importés sans passer par l'API)
+        for user_session in self.referrals.keys() - self.counters.keys():
+            self._rebuild_counters(user_session)
         
-        # Ajouter les rangs
-        for i, entry in enumerate(leaderboard[:limit]):
-            entry['rank'] = i + 1
+        # Top K sur les compteurs maintenus, sans trier toute la population
+        top = heapq.nlargest(
+            limit,
+            ((user_session, counters) for user_session, counters in self.counters.items() if counters['confirmed'] > 0),
+            key=lambda item: item[1]['confirmed']
+        )
         
-        return leaderboard[:limit]
+        leaderboard = []
+        for rank, (user_session, counters) in enumerate(top, 1):
+            confirmed_count = counters['confirmed']
+            premium_count = counters['premium']
+            tier = self._resolve_tier(confirmed_count)
+            
+            leaderboard.append({
+                'user_id': user_session[:8] + "...",  # Anonymisé
+                'tier_title': self.referral_tiers[tier].custom_title if tier else "Trader",
+                'confirmed_referrals': confirmed_count,
+                'premium_conversions': premium_count,
+                'success_rate': premium_count / confirmed_count * 100,
+                'rank': rank
+            })
+        
+        return leaderboard
     
     def _stats_to_dict(self, stats: ReferralStats) -> Dict:
         """Convertit les stats en dictionnaire"""
@@ -666,8 +704,8 @@ class ReferralSystem:
             'confirmed_referrals': stats.confirmed_referrals,
             'premium_conversions': stats.premium_conversions,
             'active_referrals': stats.active_referrals,
-            'current_tier': stats.current_tier.value if stats.current_tier else None,
-            'next_tier': stats.next_tier.value if stats.next_tier else None,
+            'current_tier': _TIER_VALUES[stats.current_tier] if stats.current_tier else None,
+            'next_tier': _TIER_VALUES[stats.next_tier] if stats.next_tier else None,
             'referrals_to_next_tier': stats.referrals_to_next_tier,
             'total_discount_earned': stats.total_discount_earned,
             'lifetime_savings': stats.lifetime_savings,
@@ -681,7 +719,7 @@ class ReferralSystem:
         """Convertit une récompense de tier en dictionnaire"""
         
         return {
-            'tier': tier_reward.tier.value,
+            'tier': _TIER_VALUES[tier_reward.tier],
             'min_referrals': tier_reward.min_referrals,
             'discount_percent': tier_reward.discount_percent,
             'months_free': tier_reward.months_free,
@@ -700,7 +738,10 @@ class ReferralSystem:
     def _code_to_dict(self, code: ReferralCode) -> Dict:
         """Convertit un code de parrainage en dictionnaire"""
         
-        return {
+        if code._cached_dict is not None and not code.is_active:
+            return code._cached_dict
+        
+        code_dict = {
             'code': code.code,
             'created_at': code.created_at.isoformat(),
             'expires_at': code.expires_at.isoformat() if code.expires_at else None,
@@ -710,20 +751,35 @@ class ReferralSystem:
             'custom_message': code.custom_message,
             'referral_url': f"https://tradingcalculatorpro.com/register?ref={code.code}"
         }
+        
+        # Un code inactif ne change plus
+        if not code.is_active:
+            code._cached_dict = code_dict
+        
+        return code_dict
     
     def _referral_to_dict(self, referral: Referral) -> Dict:
         """Convertit un parrainage en dictionnaire"""
         
-        return {
+        if referral._cached_dict is not None and referral.status == ReferralStatus.PREMIUM_CONVERTED:
+            return referral._cached_dict
+        
+        referral_dict = {
             'referral_id': referral.referral_id,
             'referred_session': referral.referred_session[:8] + "...",  # Anonymisé
             'referral_code': referral.referral_code,
             'referred_at': referral.referred_at.isoformat(),
             'confirmed_at': referral.confirmed_at.isoformat() if referral.confirmed_at else None,
             'premium_converted_at': referral.premium_converted_at.isoformat() if referral.premium_converted_at else None,
-            'status': referral.status.value,
+            'status': _STATUS_VALUES[referral.status],
             'source': referral.source
         }
+        
+        # Un parrainage converti premium ne change plus
+        if referral.status == ReferralStatus.PREMIUM_CONVERTED:
+            referral._cached_dict = referral_dict
+        
+        return referral_dict
 
 # Instance globale du système de parrainage
 referral_system = ReferralSystem()
\ No newline at end of file
@@ -4,16 +4,31 @@ Gestion des sessions, CSRF, XSS, validation et chiffrement
 """
 
 import os
+import base64
 import hashlib
+import hmac
+import json
 import secrets
+import threading
+import time
 import logging
+import logging.handlers
+import html
 import bleach
+from collections import OrderedDict, deque
+from itertools import islice
 from functools import wraps
-from datetime import datetime, timedelta
-from flask import session, request, abort, jsonify, g
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
+from flask import session, request, abort, jsonify, g, has_request_context
+from werkzeug.security import check_password_hash
 import re
 
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = Fernet = InvalidToken = None
+
 # Configuration du logging sécurisé
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +41,87 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Journal des événements de sécurité (une ligne JSON par événement, rotation par taille)
+SECURITY_LOG_FILE = 'data/security_logs.log'
+SECURITY_LOG_MAX_BYTES = 256_000
+SECURITY_LOG_BACKUP_COUNT = 4
+
+# Itérations PBKDF2-SHA256 (recommandation OWASP 2023 : 600 000 minimum)
+PBKDF2_ITERATIONS = 600_000
+
+# Taille du sel PBKDF2 (octets bruts)
+PBKDF2_SALT_BYTES = 16
+
+# Itérations des anciens hachages sans préfixe (salt + hash)
+LEGACY_PBKDF2_ITERATIONS = 100_000
+
+# Clé de chiffrement des données sensibles (32 octets encodés en base64 urlsafe)
+ENCRYPTION_KEY_FILE = 'data/.encryption_key'
+
+# Taille du nonce AES-GCM (octets)
+AES_GCM_NONCE_SIZE = 12
+
+# Début des anciens jetons Fernet (octet de version 0x80 puis horodatage), même fichier de clé
+LEGACY_FERNET_PREFIX = 'gAAAAA'
+
+# Nombre maximal d'identifiants suivis par le limiteur de taux (LRU)
+MAX_TRACKED_IDENTIFIERS = 10000
+
+# Nettoyage incrémental : toutes les N opérations, examen des K entrées les plus anciennes
+EVICTION_SCAN_INTERVAL = 256
+EVICTION_SCAN_SIZE = 8
+
+# Validation d'email en une passe (pas de regex à retour arrière)
+_EMAIL_MAX_LENGTH = 254
+_EMAIL_LOCAL_MAX_LENGTH = 64
+_EMAIL_DOMAIN_MAX_LENGTH = 253
+_ASCII_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_EMAIL_DOMAIN_OK = _ASCII_LETTERS | frozenset('0123456789.-')
+_EMAIL_LOCAL_OK = _EMAIL_DOMAIN_OK | frozenset('_%+')
+
+# Expressions régulières compilées une seule fois
+_UPPER_RE = re.compile(r'[A-Z]')
+_LOWER_RE = re.compile(r'[a-z]')
+_DIGIT_RE = re.compile(r'[0-9]')
+_SPECIAL_RE = re.compile(r'[!@#$%^&*()_+\-=\[\]{};:"\\|,.<>\?]')
+
+# Champs de trading : (clé, maximum, erreur de plage, erreur de type) ; minimum exclusif 0
+_TRADING_FIELDS = (
+    ('capital', 10_000_000, "Capital invalide (entre 1$ et 10M$)", "Capital doit être un nombre valide"),
+    ('risk_percent', 10, "Risque invalide (entre 0.1% et 10%)", "Risque doit être un nombre valide"),  # 10% max pour la sécurité
+    ('entry_price', float('inf'), "Prix d'entrée invalide", "Prix d'entrée doit être un nombre valide"),
+    ('stop_loss', float('inf'), "Stop loss invalide", "Stop loss doit être un nombre valide"),
+)
+
+# Caractères autorisés dans les champs de formulaire simples (emails, montants, symboles)
+_FORM_FIELD_FORBIDDEN_RE = re.compile(r'[^a-zA-Z0-9\-_.@ ]')
+
+def _event_timestamp():
+    """Horodatage ISO des événements, calculé une seule fois par requête"""
+    if not has_request_context():
+        return datetime.now().isoformat()
+    
+    timestamp = getattr(g, '_security_log_ts', None)
+    if timestamp is None:
+        timestamp = g._security_log_ts = datetime.now().isoformat()
+    return timestamp
+
+def _client_info():
+    """IP et User-Agent du client, lus une seule fois par requête"""
+    if not has_request_context():
+        return 'unknown', 'unknown'
+    
+    client = getattr(g, '_security_client', None)
+    if client is None:
+        client = g._security_client = (
+            request.remote_addr or 'unknown',
+            request.headers.get('User-Agent', 'unknown')
+        )
+    return client
+
+class EncryptionUnavailableError(ImportError):
+    """Le paquet cryptography est requis pour chiffrer les données sensibles"""
+
 class SecurityManager:
     """Gestionnaire de sécurité central"""
     
@@ -33,28 +129,102 @@ class SecurityManager:
         self.session_timeout = 3600  # 1 heure
         self.max_login_attempts = 5
         self.lockout_duration = 900  # 15 minutes
-        self.failed_attempts = {}
+        self._aesgcm = None
+        self._legacy_fernet = None
+        # Table unique des tentatives : identifiant -> deque des instants (time.monotonic), ordre LRU.
+        # Les échecs de connexion y sont suivis sous la clé 'login:<ip>'.
+        self.failed_attempts = OrderedDict()
+        self._max_tracked = MAX_TRACKED_IDENTIFIERS
+        self._tracking_ops = 0
+        self._attempts_lock = threading.Lock()
+        self._pbkdf2_iters = PBKDF2_ITERATIONS
+        self.security_log_file = SECURITY_LOG_FILE
+        self._seclog = self._init_security_logger()
+    
+    def _init_security_logger(self):
+        """Configure le logger dédié aux événements de sécurité"""
+        seclog = logging.getLogger('mtp.security')
         
+        if not seclog.handlers:
+            os.makedirs(os.path.dirname(self.security_log_file), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.security_log_file,
+                maxBytes=SECURITY_LOG_MAX_BYTES,
+                backupCount=SECURITY_LOG_BACKUP_COUNT,
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            seclog.addHandler(handler)
+            seclog.setLevel(logging.INFO)
+            # Journal dédié : pas de doublon dans les handlers racine
+            seclog.propagate = False
+        
+        return seclog
+
     def generate_csrf_token(self):
-        """Génère un token CSRF sécurisé"""
-        if 'csrf_token' not in session:
-            session['csrf_token'] = secrets.token_hex(32)
-        return session['csrf_token']
+        """Génère un token CSRF sécurisé (mis en cache sur g pour la requête)"""
+        token = getattr(g, '_csrf_token', None)
+        if token:
+            return token
+        
+        # La session n'est modifiée que si aucun token n'existe encore
+        token = session.get('csrf_token')
+        if not token:
+            token = secrets.token_hex(32)
+            session['csrf_token'] = token
+        
+        g._csrf_token = token
+        return token
     
     def validate_csrf_token(self, token):
-        """Valide le token CSRF"""
-        return token and session.get('csrf_token') == token
+        """Valide le token CSRF (comparaison à temps constant)"""
+        stored = getattr(g, '_csrf_token', None) or session.get('csrf_token')
+        return bool(token) and bool(stored) and hmac.compare_digest(str(stored), str(token))
     
     def hash_password(self, password):
-        """Hash sécurisé du mot de passe"""
-        return generate_password_hash(password, method='pbkdf2:sha256', salt_length=16)
+        """Hash sécurisé du mot de passe (format pbkdf2$itérations$sel_b64$hash_b64)"""
+        salt = secrets.token_bytes(PBKDF2_SALT_BYTES)
+        pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, self._pbkdf2_iters)
+        return f"pbkdf2${self._pbkdf2_iters}${base64.b64encode(salt).decode()}${base64.b64encode(pwd_hash).decode()}"
     
     def verify_password(self, password, hash_value):
-        """Vérifie le mot de passe"""
-        return check_password_hash(hash_value, password)
+        """Vérifie le mot de passe (format pbkdf2$, hash werkzeug ou ancien format sel + hash)"""
+        if not hash_value:
+            return False
+        
+        try:
+            if hash_value.startswith('pbkdf2$'):
+                # Format actuel : sel et hash binaires encodés en base64
+                _, iterations, salt, stored_pwd = hash_value.split('$')
+                salt = base64.b64decode(salt)
+                expected = base64.b64decode(stored_pwd)
+            elif ':' in hash_value:
+                # Hash généré par werkzeug (pbkdf2:sha256:..., scrypt:...)
+                return check_password_hash(hash_value, password)
+            else:
+                # Ancien format : 64 caractères de sel suivis du hash
+                iterations = LEGACY_PBKDF2_ITERATIONS
+                salt = hash_value[:64].encode('utf-8')
+                expected = bytes.fromhex(hash_value[64:])
+            iterations = int(iterations)
+        except ValueError:
+            # binascii.Error hérite de ValueError
+            return False
+        
+        pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+        # Comparaison à temps constant sur les octets bruts
+        return hmac.compare_digest(pwd_hash, expected)
+    
+    def needs_rehash(self, hash_value):
+        """Indique si le hash doit être régénéré avec les paramètres actuels"""
+        return not hash_value.startswith(f"pbkdf2${self._pbkdf2_iters}$")
     
     def sanitize_input(self, text):
-        """Nettoie les entrées utilisateur contre XSS"""
+        """Nettoie les entrées utilisateur contre XSS
+        
+        Réservé au texte riche affiché tel quel ; pour les champs de
+        formulaire simples, utiliser sanitize_form_field.
+        """
         if not text:
             return ""
         
@@ -67,104 +237,242 @@ class SecurityManager:
         
         return clean_text
     
+    def escape_input(self, data):
+        """Échappe le HTML des chaînes d'une structure (str, dict, list)
+        
+        Parcours itératif avec une pile explicite : pas de récursion, quelle
+        que soit la profondeur du JSON reçu. L'entrée n'est pas modifiée.
+        """
+        if isinstance(data, str):
+            # Échappement HTML complet (une seule passe en C)
+            return html.escape(data.strip(), quote=True)
+        if not isinstance(data, (dict, list)):
+            return data
+        
+        root = {} if isinstance(data, dict) else [None] * len(data)
+        stack = [(data, root)]
+        while stack:
+            source, target = stack.pop()
+            items = source.items() if isinstance(source, dict) else enumerate(source)
+            for key, value in items:
+                if isinstance(value, str):
+                    target[key] = html.escape(value.strip(), quote=True)
+                elif isinstance(value, dict):
+                    target[key] = child = {}
+                    stack.append((value, child))
+                elif isinstance(value, list):
+                    target[key] = child = [None] * len(value)
+                    stack.append((value, child))
+                else:
+                    target[key] = value
+        return root
+    
+    def sanitize_form_field(self, text):
+        """Nettoie un champ de formulaire simple par liste blanche de caractères"""
+        if not text:
+            return ""
+        
+        # Tout caractère hors liste blanche est remplacé par '_'
+        return _FORM_FIELD_FORBIDDEN_RE.sub('_', str(text))
+    
     def validate_email(self, email):
-        """Valide le format email"""
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        """Valide le format email (temps linéaire, longueurs bornées)"""
+        if not email or len(email) > _EMAIL_MAX_LENGTH:
+            return False
+        
+        at = email.rfind('@')
+        if at < 1 or at > _EMAIL_LOCAL_MAX_LENGTH:
+            return False
+        
+        local, domain = email[:at], email[at + 1:]
+        if len(domain) > _EMAIL_DOMAIN_MAX_LENGTH:
+            return False
+        
+        # Au moins un caractère avant le dernier point, TLD alphabétique de 2+ lettres
+        name, _, tld = domain.rpartition('.')
+        if not name or len(tld) < 2 or not _ASCII_LETTERS.issuperset(tld):
+            return False
+        
+        return _EMAIL_LOCAL_OK.issuperset(local) and _EMAIL_DOMAIN_OK.issuperset(name)
     
     def validate_password_strength(self, password):
         """Valide la force du mot de passe"""
         if len(password) < 8:
             return False, "Le mot de passe doit contenir au moins 8 caractères"
         
-        if not re.search(r'[A-Z]', password):
+        if not _UPPER_RE.search(password):
             return False, "Le mot de passe doit contenir au moins une majuscule"
         
-        if not re.search(r'[a-z]', password):
+        if not _LOWER_RE.search(password):
             return False, "Le mot de passe doit contenir au moins une minuscule"
         
-        if not re.search(r'[0-9]', password):
+        if not _DIGIT_RE.search(password):
             return False, "Le mot de passe doit contenir au moins un chiffre"
         
-        if not re.search(r'[!@#$%^&*()_+\-=\[\]{};:"\\|,.<>\?]', password):
+        if not _SPECIAL_RE.search(password):
             return False, "Le mot de passe doit contenir au moins un caractère spécial"
         
         return True, "Mot de passe valide"
     
     def check_rate_limit(self, identifier, max_requests=10, time_window=60):
-        """Vérifie les limites de taux"""
-        now = datetime.now()
+        """Vérifie les limites de taux (fenêtre glissante)
         
-        if identifier not in self.failed_attempts:
-            self.failed_attempts[identifier] = []
+        Retourne (autorisé, message d'erreur ou None).
+        """
+        with self._attempts_lock:
+            now = time.monotonic()
+            attempts = self._get_attempts(identifier, now)
+            
+            # Retire les tentatives sorties de la fenêtre
+            cutoff = now - time_window
+            while attempts and attempts[0] <= cutoff:
+                attempts.popleft()
+            
+            # Vérifie la limite
+            if len(attempts) >= max_requests:
+                return False, "Trop de requêtes"
+            
+            # Ajoute la tentative actuelle
+            attempts.append(now)
+            return True, None
+    
+    def check_login_lockout(self, ip_address):
+        """Vérifie si l'IP est bloquée après trop d'échecs de connexion
         
-        # Nettoie les tentatives anciennes
-        self.failed_attempts[identifier] = [
-            attempt for attempt in self.failed_attempts[identifier]
-            if now - attempt < timedelta(seconds=time_window)
-        ]
+        Retourne (autorisé, message d'erreur ou None).
+        """
+        with self._attempts_lock:
+            attempts = self.failed_attempts.get(f'login:{ip_address}')
+            if attempts:
+                cutoff = time.monotonic() - self.lockout_duration
+                while attempts and attempts[0] <= cutoff:
+                    attempts.popleft()
+                if len(attempts) >= self.max_login_attempts:
+                    return False, f"Trop de tentatives. Réessayez dans {self.lockout_duration // 60} minutes."
+        return True, None
+    
+    def record_failed_attempt(self, ip_address):
+        """Enregistre une tentative de connexion échouée"""
+        with self._attempts_lock:
+            now = time.monotonic()
+            attempts = self._get_attempts(f'login:{ip_address}', now)
+            attempts.append(now)
+            count = len(attempts)
         
-        # Vérifie la limite
-        if len(self.failed_attempts[identifier]) >= max_requests:
-            return False
+        # Journalisation hors verrou (I/O disque)
+        self.log_security_event('failed_login', {
+            'ip': ip_address,
+            'attempts': count
+        })
+    
+    def reset_failed_attempts(self, ip_address):
+        """Remet à zéro les tentatives de connexion échouées"""
+        with self._attempts_lock:
+            self.failed_attempts.pop(f'login:{ip_address}', None)
+    
+    def _get_attempts(self, identifier, now):
+        """Retourne la deque des tentatives de l'identifiant (LRU borné, verrou requis)"""
+        # Éviction avant la recherche : l'entrée retournée ne peut pas être supprimée
+        self._evict_expired_attempts(now)
+        attempts = self.failed_attempts.get(identifier)
+        if attempts is None:
+            attempts = self.failed_attempts[identifier] = deque()
+            if len(self.failed_attempts) > self._max_tracked:
+                self.failed_attempts.popitem(last=False)
+        else:
+            self.failed_attempts.move_to_end(identifier)
+        return attempts
+    
+    def _evict_expired_attempts(self, now):
+        """Supprime périodiquement quelques identifiants inactifs parmi les plus anciens"""
+        self._tracking_ops += 1
+        if self._tracking_ops % EVICTION_SCAN_INTERVAL:
+            return
         
-        # Ajoute la tentative actuelle
-        self.failed_attempts[identifier].append(now)
-        return True
+        # Horizon : la durée de blocage, supérieure aux fenêtres de limitation
+        expiry = now - self.lockout_duration
+        for identifier in list(islice(self.failed_attempts, EVICTION_SCAN_SIZE)):
+            attempts = self.failed_attempts[identifier]
+            if attempts and attempts[-1] >= expiry:
+                break
+            del self.failed_attempts[identifier]
     
     def log_security_event(self, event_type, details, user_id=None):
-        """Log les événements de sécurité"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'event_type': event_type,
-            'details': details,
-            'user_id': user_id,
-            'ip_address': request.remote_addr if request else 'unknown',
-            'user_agent': request.headers.get('User-Agent') if request else 'unknown'
-        }
-        
-        logger.warning(f"SECURITY_EVENT: {log_entry}")
+        """Log les événements de sécurité (ligne JSON dédiée + avertissement SECURITY_EVENT)"""
+        try:
+            ip_address, user_agent = _client_info()
+            log_entry = {
+                'timestamp': _event_timestamp(),
+                'event_type': event_type,
+                'details': details,
+                'user_id': user_id,
+                'ip_address': ip_address,
+                'user_agent': user_agent
+            }
+            
+            self._seclog.info(json.dumps(log_entry, ensure_ascii=False, default=str))
+            # Ligne historique : reste visible dans data/security.log et sur la console
+            logger.warning(f"SECURITY_EVENT: {log_entry}")
+        except Exception as e:
+            logger.error(f"Erreur lors de l'écriture des logs de sécurité: {e}")
+    
+    def _get_aesgcm(self):
+        """Charge (ou génère) la clé de chiffrement une seule fois"""
+        if self._aesgcm is None:
+            if AESGCM is None:
+                raise EncryptionUnavailableError(
+                    "Le chiffrement des données sensibles nécessite le paquet 'cryptography'"
+                )
+            
+            if os.path.exists(ENCRYPTION_KEY_FILE):
+                with open(ENCRYPTION_KEY_FILE, 'rb') as f:
+                    key = base64.urlsafe_b64decode(f.read().strip())
+            else:
+                key = AESGCM.generate_key(bit_length=256)
+                os.makedirs(os.path.dirname(ENCRYPTION_KEY_FILE), exist_ok=True)
+                with open(ENCRYPTION_KEY_FILE, 'wb') as f:
+                    f.write(base64.urlsafe_b64encode(key))
+            
+            self._aesgcm = AESGCM(key)
+            # La clé Fernet historique est la même clé de 32 octets
+            self._legacy_fernet = Fernet(base64.urlsafe_b64encode(key))
+        return self._aesgcm
     
     def encrypt_sensitive_data(self, data):
-        """Chiffre les données sensibles"""
-        # Implémentation basique - à améliorer avec une vraie clé de chiffrement
-        return hashlib.sha256(data.encode()).hexdigest()
+        """Chiffre les données sensibles (AES-256-GCM, nonce aléatoire en préfixe)"""
+        nonce = os.urandom(AES_GCM_NONCE_SIZE)
+        ciphertext = self._get_aesgcm().encrypt(nonce, data.encode(), None)
+        return base64.urlsafe_b64encode(nonce + ciphertext).decode()
+    
+    def decrypt_sensitive_data(self, encrypted_data):
+        """Déchiffre une valeur produite par encrypt_sensitive_data (ou un ancien jeton Fernet)"""
+        aesgcm = self._get_aesgcm()
+        
+        if encrypted_data.startswith(LEGACY_FERNET_PREFIX):
+            try:
+                return self._legacy_fernet.decrypt(encrypted_data.encode()).decode()
+            except InvalidToken:
+                pass  # Jeton AES-GCM dont le nonce commence par les mêmes octets
+        
+        raw = base64.urlsafe_b64decode(encrypted_data.encode())
+        nonce, ciphertext = raw[:AES_GCM_NONCE_SIZE], raw[AES_GCM_NONCE_SIZE:]
+        return aesgcm.decrypt(nonce, ciphertext, None).decode()
+    
+    def needs_reencrypt(self, encrypted_data):
+        """Indique si la valeur est un ancien jeton Fernet à rechiffrer en AES-GCM"""
+        return encrypted_data.startswith(LEGACY_FERNET_PREFIX)
     
     def validate_trading_input(self, data):
         """Valide les entrées de trading"""
         errors = []
         
-        # Validation du capital
-        try:
-            capital = float(data.get('capital', 0))
-            if capital <= 0 or capital > 10000000:  # 10M max
-                errors.append("Capital invalide (entre 1$ et 10M$)")
-        except (ValueError, TypeError):
-            errors.append("Capital doit être un nombre valide")
-        
-        # Validation du risque
-        try:
-            risk = float(data.get('risk_percent', 0))
-            if risk <= 0 or risk > 10:  # 10% max pour la sécurité
-                errors.append("Risque invalide (entre 0.1% et 10%)")
-        except (ValueError, TypeError):
-            errors.append("Risque doit être un nombre valide")
-        
-        # Validation du prix d'entrée
-        try:
-            entry_price = float(data.get('entry_price', 0))
-            if entry_price <= 0:
-                errors.append("Prix d'entrée invalide")
-        except (ValueError, TypeError):
-            errors.append("Prix d'entrée doit être un nombre valide")
-        
-        # Validation du stop loss
-        try:
-            stop_loss = float(data.get('stop_loss', 0))
-            if stop_loss <= 0:
-                errors.append("Stop loss invalide")
-        except (ValueError, TypeError):
-            errors.append("Stop loss doit être un nombre valide")
+        for key, max_value, range_error, type_error in _TRADING_FIELDS:
+            try:
+                value = float(data.get(key, 0))
+                if value <= 0 or value > max_value:
+                    errors.append(range_error)
+            except (ValueError, TypeError):
+                errors.append(type_error)
         
         return len(errors) == 0, errors
 
@@ -197,10 +505,11 @@ def rate_limit(max_requests=10, time_window=60):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            identifier = request.remote_addr
-            if not security.check_rate_limit(identifier, max_requests, time_window):
+            identifier = _client_info()[0]
+            allowed, message = security.check_rate_limit(identifier, max_requests, time_window)
+            if not allowed:
                 security.log_security_event('RATE_LIMIT_EXCEEDED', f'IP: {identifier}')
-                return jsonify({'error': 'Trop de requêtes'}), 429
+                return jsonify({'error': message}), 429
             return f(*args, **kwargs)
         return decorated_function
     return decorator
\ No newline at end of file
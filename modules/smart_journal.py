@@ -1,11 +1,32 @@
 """
 Journal de Trading Intelligent avec enregistrement automatique et analyse avancée
 """
-from dataclasses import dataclass
+import csv
+import io
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from enum import Enum
+import itertools
 import json
+from functools import lru_cache
+
+# Nombre de trades récents conservés par utilisateur pour l'analyse des patterns
+RECENT_TRADES_WINDOW = 5
+
+# En-tête de l'export CSV
+CSV_HEADER = (
+    'Trade_ID', 'Pair', 'Direction', 'Lot_Size', 'Entry_Price', 'Exit_Price', 'Stop_Loss', 'Take_Profit',
+    'Entry_Time', 'Exit_Time', 'Profit_Loss', 'Profit_Loss_Pips', 'Status', 'Strategy', 'Emotional_State',
+    'Confidence', 'Stress', 'Risk_Reward', 'Notes', 'Tags'
+)
+
+# Taille des caches du contexte (heure x jour) et de la structure de marché (paire)
+MARKET_CACHE_SIZE = 4096
+
+# Séparateur des champs dans _search_blob : une recherche ne peut pas chevaucher deux champs
+SEARCH_FIELD_SEPARATOR = '\x00'
 
 class TradeStatus(Enum):
     OPEN = "open"
@@ -32,7 +53,63 @@ class TradeStrategy(Enum):
     SMC = "smart_money_concepts"
     ICT = "ict_concepts"
 
-@dataclass
+def _members_by_value(enum_cls):
+    """Table valeur -> membre (les membres eux-mêmes sont aussi acceptés)"""
+    lookup = {member.value: member for member in enum_cls}
+    lookup.update({member: member for member in enum_cls})
+    return lookup
+
+# Conversions pré-calculées (évite la recherche de Enum.__call__ à chaque trade)
+_STATUS_BY_VALUE = _members_by_value(TradeStatus)
+_EMOTION_BY_VALUE = _members_by_value(EmotionalState)
+_STRATEGY_BY_VALUE = _members_by_value(TradeStrategy)
+
+# Valeur de filtre inconnue : ne correspond à aucun membre
+_NO_MATCH = object()
+
+def _most_frequent_hour(trades) -> int:
+    """Heure d'entrée la plus fréquente (comptage en une passe, égalité : heure la plus tôt)"""
+    hour_counts = Counter(t.entry_time.hour for t in trades)
+    return min(hour_counts, key=lambda hour: (-hour_counts[hour], hour))
+
+@lru_cache(maxsize=MARKET_CACHE_SIZE)
+def _market_context(hour: int, day_of_week: int) -> str:
+    """Contexte de marché pour une heure et un jour de la semaine donnés"""
+    
+    # Analyse des sessions de trading
+    sessions = []
+    if 7 <= hour <= 16:
+        sessions.append("Londres")
+    if 13 <= hour <= 22:
+        sessions.append("New York")
+    if 0 <= hour <= 9:
+        sessions.append("Asie")
+    
+    # Analyse de la volatilité attendue
+    volatility = "normale"
+    if day_of_week == 4:  # Vendredi
+        volatility = "réduite"
+    elif 8 <= hour <= 12:  # Overlap Londres-NY
+        volatility = "élevée"
+    
+    # Événements économiques (simulation)
+    economic_impact = "aucun événement majeur"
+    if hour in [14, 15, 16]:  # Heures typiques des annonces US
+        economic_impact = "possible volatilité sur annonces"
+    
+    return f"Sessions: {', '.join(sessions) if sessions else 'Hors session'}. " \
+           f"Volatilité: {volatility}. {economic_impact}."
+
+@lru_cache(maxsize=MARKET_CACHE_SIZE)
+def _market_structure(pair_symbol: str) -> str:
+    """Structure de marché d'une paire (simulation)"""
+    # En production, ceci ferait appel à une analyse technique réelle
+    # Simulation basée sur la paire
+    if "USD" in pair_symbol:
+        return "uptrend" if pair_symbol.startswith("USD") else "downtrend"
+    return "sideways"
+
+@dataclass(slots=True)
 class SmartTradeEntry:
     """Entrée de trade intelligente avec métadonnées complètes"""
     # Informations de base
@@ -85,6 +162,9 @@ class SmartTradeEntry:
     
     created_at: datetime
     updated_at: datetime
+    
+    # Texte de recherche en minuscules (notes, paire, stratégie, tags), voir _index_search_text
+    _search_blob: str = field(default='', repr=False, compare=False)
 
 class SmartJournalManager:
     """Gestionnaire intelligent du journal de trading"""
@@ -93,15 +173,29 @@ class SmartJournalManager:
         self.trades = {}
         self.filters = {}
         self.auto_import_enabled = True
+        # Index des trades par utilisateur (ordre d'ajout)
+        self._user_trades = defaultdict(list)
+        # Derniers trades ajoutés par utilisateur (analyse des patterns sans parcours complet)
+        self._user_recent = defaultdict(lambda: deque(maxlen=RECENT_TRADES_WINDOW))
+        # Suffixe des identifiants : unicité sans relire l'horloge
+        self._trade_sequence = itertools.count(1)
+        
+    def add_trade(self, trade_data: Dict, *, analyze_patterns: bool = True,
+                  skip_enrichment: bool = False) -> str:
+        """Ajoute un nouveau trade avec validation intelligente
         
-    def add_trade(self, trade_data: Dict) -> str:
-        """Ajoute un nouveau trade avec validation intelligente"""
+        Avec skip_enrichment=True, trade_data fournit déjà market_context,
+        market_structure et risk_reward_ratio (données importées ou enrichies en lot).
+        """
+        
+        # Horodatage unique pour l'identifiant, la création et la mise à jour
+        now = datetime.now()
         
         # Génération ID unique
-        trade_id = f"trade_{int(datetime.now().timestamp())}_{trade_data.get('pair_symbol', 'XXX')}"
+        trade_id = f"trade_{int(now.timestamp())}_{trade_data.get('pair_symbol', 'XXX')}_{next(self._trade_sequence)}"
         
         # Validation et enrichissement automatique
-        enriched_data = self._enrich_trade_data(trade_data)
+        enriched_data = trade_data if skip_enrichment else self._enrich_trade_data(trade_data, now)
         
         # Création de l'entrée de trade
         trade_entry = SmartTradeEntry(
@@ -114,15 +208,15 @@ class SmartJournalManager:
             exit_price=trade_data.get('exit_price'),
             stop_loss=trade_data['stop_loss'],
             take_profit=trade_data['take_profit'],
-            entry_time=trade_data.get('entry_time', datetime.now()),
+            entry_time=trade_data.get('entry_time', now),
             exit_time=trade_data.get('exit_time'),
             profit_loss=trade_data.get('profit_loss'),
             profit_loss_pips=trade_data.get('profit_loss_pips'),
-            status=TradeStatus(trade_data.get('status', 'open')),
-            strategy=TradeStrategy(trade_data.get('strategy', 'day_trading')),
+            status=_STATUS_BY_VALUE[trade_data.get('status', 'open')],
+            strategy=_STRATEGY_BY_VALUE[trade_data.get('strategy', 'day_trading')],
             market_context=enriched_data['market_context'],
             confluence_factors=trade_data.get('confluence_factors', []),
-            emotional_state=EmotionalState(trade_data.get('emotional_state', 'calm')),
+            emotional_state=_EMOTION_BY_VALUE[trade_data.get('emotional_state', 'calm')],
             confidence_level=trade_data.get('confidence_level', 5),
             stress_level=trade_data.get('stress_level', 3),
             notes=trade_data.get('notes', ''),
@@ -137,23 +231,54 @@ class SmartJournalManager:
             setup_quality=trade_data.get('setup_quality', 7),
             execution_quality=trade_data.get('execution_quality', 7),
             risk_reward_ratio=enriched_data['risk_reward_ratio'],
-            created_at=datetime.now(),
-            updated_at=datetime.now()
+            created_at=now,
+            updated_at=now
         )
         
         # Sauvegarde
+        self._index_search_text(trade_entry)
         self.trades[trade_id] = trade_entry
+        self._user_trades[trade_entry.user_session].append(trade_entry)
+        self._user_recent[trade_entry.user_session].append(trade_entry)
         self._save_to_database(trade_entry)
         
         # Analyse automatique post-ajout
-        self._analyze_trade_patterns(trade_entry)
+        if analyze_patterns:
+            self._analyze_trade_patterns(trade_entry)
         
         return trade_id
     
-    def _enrich_trade_data(self, trade_data: Dict) -> Dict:
+    def bulk_add_trades(self, trades_data: List[Dict], *, skip_enrichment: bool = False) -> List[str]:
+        """Ajoute une série de trades, avec une seule analyse des patterns par utilisateur"""
+        trade_ids = [
+            self.add_trade(trade_data, analyze_patterns=False, skip_enrichment=skip_enrichment)
+            for trade_data in trades_data
+        ]
+        
+        # Analyse différée : une fois par utilisateur concerné, sur ses derniers trades
+        for user_session in dict.fromkeys(self.trades[trade_id].user_session for trade_id in trade_ids):
+            self._analyze_trade_patterns(self._user_recent[user_session][-1])
+        
+        return trade_ids
+    
+    def _enrich_trade_data(self, trade_data: Dict, now: Optional[datetime] = None) -> Dict:
         """Enrichit automatiquement les données du trade"""
         
-        # Calcul du Risk/Reward ratio
+        # Analyse du contexte de marché (simulation intelligente)
+        entry_time = trade_data.get('entry_time', now or datetime.now())
+        market_context = self._analyze_market_context(trade_data['pair_symbol'], entry_time)
+        
+        # Détermination de la structure de marché
+        market_structure = self._determine_market_structure(trade_data['pair_symbol'])
+        
+        return {
+            'risk_reward_ratio': self._calculate_risk_reward(trade_data),
+            'market_context': market_context,
+            'market_structure': market_structure
+        }
+    
+    def _calculate_risk_reward(self, trade_data: Dict) -> float:
+        """Calcul du Risk/Reward ratio (arrondi à 2 décimales)"""
         entry_price = trade_data['entry_price']
         stop_loss = trade_data['stop_loss']
         take_profit = trade_data['take_profit']
@@ -167,56 +292,16 @@ class SmartJournalManager:
         
         risk_reward_ratio = reward_pips / risk_pips if risk_pips > 0 else 0
         
-        # Analyse du contexte de marché (simulation intelligente)
-        market_context = self._analyze_market_context(trade_data['pair_symbol'], trade_data.get('entry_time', datetime.now()))
-        
-        # Détermination de la structure de marché
-        market_structure = self._determine_market_structure(trade_data['pair_symbol'])
-        
-        return {
-            'risk_reward_ratio': round(risk_reward_ratio, 2),
-            'market_context': market_context,
-            'market_structure': market_structure
-        }
+        return round(risk_reward_ratio, 2)
     
     def _analyze_market_context(self, pair_symbol: str, entry_time: datetime) -> str:
         """Analyse le contexte de marché au moment du trade"""
-        
-        # Analyse des sessions de trading
-        hour = entry_time.hour
-        day_of_week = entry_time.weekday()
-        
-        sessions = []
-        if 7 <= hour <= 16:
-            sessions.append("Londres")
-        if 13 <= hour <= 22:
-            sessions.append("New York")
-        if 0 <= hour <= 9:
-            sessions.append("Asie")
-        
-        # Analyse de la volatilité attendue
-        volatility = "normale"
-        if day_of_week == 4:  # Vendredi
-            volatility = "réduite"
-        elif 8 <= hour <= 12:  # Overlap Londres-NY
-            volatility = "élevée"
-        
-        # Événements économiques (simulation)
-        economic_impact = "aucun événement majeur"
-        if hour in [14, 15, 16]:  # Heures typiques des annonces US
-            economic_impact = "possible volatilité sur annonces"
-        
-        return f"Sessions: {', '.join(sessions) if sessions else 'Hors session'}. " \
-               f"Volatilité: {volatility}. {economic_impact}."
+        # Ne dépend que de l'heure et du jour : résultat mis en cache
+        return _market_context(entry_time.hour, entry_time.weekday())
     
     def _determine_market_structure(self, pair_symbol: str) -> str:
         """Détermine la structure de marché (simulation)"""
-        # En production, ceci ferait appel à une analyse technique réelle
-        structures = ["uptrend", "downtrend", "sideways", "consolidation"]
-        # Simulation basée sur la paire
-        if "USD" in pair_symbol:
-            return "uptrend" if pair_symbol.startswith("USD") else "downtrend"
-        return "sideways"
+        return _market_structure(pair_symbol)
     
     def _analyze_trade_patterns(self, trade: SmartTradeEntry):
         """Analyse automatique des patterns après ajout d'un trade"""
@@ -227,15 +312,12 @@ class SmartJournalManager:
         # - Suggestions d'amélioration
         # - Alertes sur le comportement de trading
         
-        user_trades = self.get_user_trades(trade.user_session)
+        recent_trades = self._user_recent[trade.user_session]
         
         # Exemple d'analyse simple
-        if len(user_trades) >= 5:
-            recent_trades = user_trades[-5:]
-            
+        if len(recent_trades) >= RECENT_TRADES_WINDOW:
             # Analyse des heures de trading
-            hours = [t.entry_time.hour for t in recent_trades]
-            most_common_hour = max(set(hours), key=hours.count)
+            most_common_hour = _most_frequent_hour(recent_trades)
             
             # Analyse des émotions
             emotions = [t.emotional_state.value for t in recent_trades]
@@ -246,49 +328,51 @@ class SmartJournalManager:
     def get_user_trades(self, user_session: str, filters: Optional[Dict] = None) -> List[SmartTradeEntry]:
         """Récupère les trades d'un utilisateur avec filtres optionnels"""
         
-        user_trades = [trade for trade in self.trades.values() 
-                      if trade.user_session == user_session]
+        # Lecture de l'index : coût proportionnel aux trades de l'utilisateur
+        user_trades = self._user_trades.get(user_session, [])
         
         if not filters:
             return sorted(user_trades, key=lambda x: x.created_at, reverse=True)
         
-        # Application des filtres
-        filtered_trades = user_trades
+        # Construction des prédicats actifs avant le parcours : un seul passage
+        # sur les trades, sans liste intermédiaire par filtre
+        predicates = []
         
+        # Filtres d'énumération : conversion unique puis comparaison d'identité
         if 'strategy' in filters:
-            filtered_trades = [t for t in filtered_trades 
-                             if t.strategy and t.strategy.value == filters['strategy']]
+            strategy = _STRATEGY_BY_VALUE.get(filters['strategy'], _NO_MATCH)
+            predicates.append(lambda t: t.strategy is strategy)
         
         if 'pair_symbol' in filters:
-            filtered_trades = [t for t in filtered_trades 
-                             if t.pair_symbol == filters['pair_symbol']]
+            pair_symbol = filters['pair_symbol']
+            predicates.append(lambda t: t.pair_symbol == pair_symbol)
         
         if 'status' in filters:
-            filtered_trades = [t for t in filtered_trades 
-                             if t.status.value == filters['status']]
+            status = _STATUS_BY_VALUE.get(filters['status'], _NO_MATCH)
+            predicates.append(lambda t: t.status is status)
         
         if 'date_from' in filters:
             date_from = datetime.fromisoformat(filters['date_from'])
-            filtered_trades = [t for t in filtered_trades 
-                             if t.entry_time >= date_from]
+            predicates.append(lambda t: t.entry_time >= date_from)
         
         if 'date_to' in filters:
             date_to = datetime.fromisoformat(filters['date_to'])
-            filtered_trades = [t for t in filtered_trades 
-                             if t.entry_time <= date_to]
+            predicates.append(lambda t: t.entry_time <= date_to)
         
         if 'tags' in filters:
             filter_tags = filters['tags'] if isinstance(filters['tags'], list) else [filters['tags']]
-            filtered_trades = [t for t in filtered_trades 
-                             if any(tag in t.tags for tag in filter_tags)]
+            predicates.append(lambda t: any(tag in t.tags for tag in filter_tags))
         
         if 'min_profit' in filters:
-            filtered_trades = [t for t in filtered_trades 
-                             if t.profit_loss and t.profit_loss >= filters['min_profit']]
+            min_profit = filters['min_profit']
+            predicates.append(lambda t: t.profit_loss and t.profit_loss >= min_profit)
         
         if 'emotional_state' in filters:
-            filtered_trades = [t for t in filtered_trades 
-                             if t.emotional_state.value == filters['emotional_state']]
+            emotional_state = _EMOTION_BY_VALUE.get(filters['emotional_state'], _NO_MATCH)
+            predicates.append(lambda t: t.emotional_state is emotional_state)
+        
+        filtered_trades = [t for t in user_trades
+                           if all(predicate(t) for predicate in predicates)]
         
         return sorted(filtered_trades, key=lambda x: x.created_at, reverse=True)
     
@@ -298,30 +382,17 @@ class SmartJournalManager:
         user_trades = self.get_user_trades(user_session)
         search_query = search_query.lower()
         
-        matching_trades = []
-        
-        for trade in user_trades:
-            # Recherche dans les notes
-            if search_query in trade.notes.lower():
-                matching_trades.append(trade)
-                continue
-            
-            # Recherche dans les tags
-            if any(search_query in tag.lower() for tag in trade.tags):
-                matching_trades.append(trade)
-                continue
-            
-            # Recherche par paire
-            if search_query in trade.pair_symbol.lower():
-                matching_trades.append(trade)
-                continue
-            
-            # Recherche par stratégie
-            if trade.strategy and search_query in trade.strategy.value.lower():
-                matching_trades.append(trade)
-                continue
-        
-        return matching_trades
+        # Notes, tags, paire et stratégie : un seul test sur le texte pré-calculé
+        return [trade for trade in user_trades if search_query in trade._search_blob]
+    
+    def _index_search_text(self, trade: SmartTradeEntry):
+        """Pré-calcule le texte de recherche du trade (à l'ajout et à chaque mise à jour)"""
+        trade._search_blob = SEARCH_FIELD_SEPARATOR.join([
+            trade.notes,
+            trade.pair_symbol,
+            trade.strategy.value if trade.strategy else '',
+            *trade.tags
+        ]).lower()
     
     def update_trade(self, trade_id: str, updates: Dict) -> bool:
         """Met à jour un trade existant"""
@@ -330,20 +401,27 @@ class SmartJournalManager:
             return False
         
         trade = self.trades[trade_id]
+        previous_session = trade.user_session
         
         # Mise à jour des champs modifiables
         for field, value in updates.items():
             if hasattr(trade, field):
                 if field == 'status':
-                    setattr(trade, field, TradeStatus(value))
+                    setattr(trade, field, _STATUS_BY_VALUE[value])
                 elif field == 'strategy':
-                    setattr(trade, field, TradeStrategy(value))
+                    setattr(trade, field, _STRATEGY_BY_VALUE[value])
                 elif field == 'emotional_state':
-                    setattr(trade, field, EmotionalState(value))
+                    setattr(trade, field, _EMOTION_BY_VALUE[value])
                 else:
                     setattr(trade, field, value)
         
         trade.updated_at = datetime.now()
+        self._index_search_text(trade)
+        
+        # Trade réattribué : mise à jour de l'index par utilisateur
+        if trade.user_session != previous_session:
+            self._user_trades[previous_session].remove(trade)
+            self._user_trades[trade.user_session].append(trade)
         
         # Recalcul automatique du R/R si les prix changent
         if any(field in updates for field in ['exit_price', 'stop_loss', 'take_profit']):
@@ -367,6 +445,26 @@ class SmartJournalManager:
             # Simulation du profit en USD (à adapter selon le lot size)
             trade.profit_loss = trade.profit_loss_pips * trade.lot_size * 1.0  # Approximation
     
+    def reprice_many(self, trade_ids: List[str]) -> int:
+        """Recalcule pips et profit d'un lot de trades (import MT4, valorisation de fin de journée)"""
+        
+        trades = self.trades
+        repriced = 0
+        
+        # Même formule que _recalculate_metrics, en une boucle sans appel de méthode par trade
+        for trade_id in trade_ids:
+            trade = trades.get(trade_id)
+            if trade is None or not trade.exit_price:
+                continue
+        
+            sign = 1.0 if trade.direction.upper() == 'BUY' else -1.0
+            pips = sign * (trade.exit_price - trade.entry_price) * 10000
+            trade.profit_loss_pips = pips
+            trade.profit_loss = pips * trade.lot_size * 1.0  # Approximation
+            repriced += 1
+        
+        return repriced
+    
     def get_trading_insights(self, user_session: str) -> Dict:
         """Génère des insights intelligents sur le trading"""
         
@@ -378,23 +476,33 @@ class SmartJournalManager:
         insights = {}
         
         # Analyse des heures préférées
-        hours = [t.entry_time.hour for t in user_trades]
-        most_active_hour = max(set(hours), key=hours.count)
+        most_active_hour = _most_frequent_hour(user_trades)
         insights['best_trading_hour'] = f"Vous tradez le plus à {most_active_hour}h"
         
-        # Analyse des émotions vs performance
+        # Émotions et paires vs performance : somme et nombre par clé, en une seule passe
         emotional_performance = {}
+        pair_performance = {}
         for trade in user_trades:
-            if trade.profit_loss:
-                emotion = trade.emotional_state.value
-                if emotion not in emotional_performance:
-                    emotional_performance[emotion] = []
-                emotional_performance[emotion].append(trade.profit_loss)
+            profit = trade.profit_loss
+            if profit:
+                totals = emotional_performance.get(trade.emotional_state.value)
+                if totals is None:
+                    emotional_performance[trade.emotional_state.value] = [profit, 1]
+                else:
+                    totals[0] += profit
+                    totals[1] += 1
+                
+                totals = pair_performance.get(trade.pair_symbol)
+                if totals is None:
+                    pair_performance[trade.pair_symbol] = [profit, 1]
+                else:
+                    totals[0] += profit
+                    totals[1] += 1
         
         best_emotion = None
         best_avg = float('-inf')
-        for emotion, profits in emotional_performance.items():
-            avg_profit = sum(profits) / len(profits)
+        for emotion, (total, count) in emotional_performance.items():
+            avg_profit = total / count
             if avg_profit > best_avg:
                 best_avg = avg_profit
                 best_emotion = emotion
@@ -403,19 +511,11 @@ class SmartJournalManager:
             insights['best_emotional_state'] = f"Vous performez mieux quand vous êtes {best_emotion}"
         
         # Analyse des paires
-        pair_performance = {}
-        for trade in user_trades:
-            if trade.profit_loss:
-                pair = trade.pair_symbol
-                if pair not in pair_performance:
-                    pair_performance[pair] = []
-                pair_performance[pair].append(trade.profit_loss)
-        
         best_pair = None
         best_pair_avg = float('-inf')
-        for pair, profits in pair_performance.items():
-            if len(profits) >= 3:  # Au moins 3 trades
-                avg_profit = sum(profits) / len(profits)
+        for pair, (total, count) in pair_performance.items():
+            if count >= 3:  # Au moins 3 trades
+                avg_profit = total / count
                 if avg_profit > best_pair_avg:
                     best_pair_avg = avg_profit
                     best_pair = pair
@@ -433,52 +533,66 @@ class SmartJournalManager:
     
     def import_from_mt4(self, user_session: str, mt4_data: Dict) -> List[str]:
         """Import automatique depuis MetaTrader 4"""
-        imported_trades = []
+        trades_data = []
+        
+        # Un seul horodatage pour tout l'import
+        import_timestamp = datetime.now()
         
         # Simulation d'import MT4
         for trade_data in mt4_data.get('trades', []):
-            enriched_data = {
+            pair_symbol = trade_data['symbol']
+            entry_time = datetime.fromtimestamp(trade_data['open_time'])
+            
+            row = {
                 'user_session': user_session,
-                'pair_symbol': trade_data['symbol'],
+                'pair_symbol': pair_symbol,
                 'direction': 'BUY' if trade_data['type'] == 0 else 'SELL',
                 'lot_size': trade_data['lots'],
                 'entry_price': trade_data['open_price'],
                 'exit_price': trade_data.get('close_price'),
                 'stop_loss': trade_data.get('sl', 0),
                 'take_profit': trade_data.get('tp', 0),
-                'entry_time': datetime.fromtimestamp(trade_data['open_time']),
+                'entry_time': entry_time,
                 'exit_time': datetime.fromtimestamp(trade_data['close_time']) if trade_data.get('close_time') else None,
                 'profit_loss': trade_data.get('profit'),
                 'status': 'closed' if trade_data.get('close_time') else 'open',
                 'imported_from': 'MT4',
-                'import_timestamp': datetime.now(),
-                'notes': f"Import automatique MT4 - Ticket #{trade_data.get('ticket', 'N/A')}"
+                'import_timestamp': import_timestamp,
+                'notes': f"Import automatique MT4 - Ticket #{trade_data.get('ticket', 'N/A')}",
+                # Contexte et structure en cache : une évaluation par (heure, jour) et par paire
+                'market_context': _market_context(entry_time.hour, entry_time.weekday()),
+                'market_structure': _market_structure(pair_symbol)
             }
-            
-            trade_id = self.add_trade(enriched_data)
-            imported_trades.append(trade_id)
+            row['risk_reward_ratio'] = self._calculate_risk_reward(row)
+            trades_data.append(row)
         
-        return imported_trades
+        # Ajout groupé : l'analyse des patterns n'est lancée qu'une fois en fin d'import
+        return self.bulk_add_trades(trades_data, skip_enrichment=True)
     
     def export_to_csv(self, user_session: str, filters: Optional[Dict] = None) -> str:
         """Export des trades au format CSV"""
         trades = self.get_user_trades(user_session, filters)
         
-        csv_content = "Trade_ID,Pair,Direction,Lot_Size,Entry_Price,Exit_Price,Stop_Loss,Take_Profit," \
-                     "Entry_Time,Exit_Time,Profit_Loss,Profit_Loss_Pips,Status,Strategy,Emotional_State," \
-                     "Confidence,Stress,Risk_Reward,Notes,Tags\n"
-        
-        for trade in trades:
-            csv_content += f"{trade.trade_id},{trade.pair_symbol},{trade.direction},{trade.lot_size}," \
-                          f"{trade.entry_price},{trade.exit_price or ''}," \
-                          f"{trade.stop_loss},{trade.take_profit}," \
-                          f"{trade.entry_time.isoformat()},{trade.exit_time.isoformat() if trade.exit_time else ''}," \
-                          f"{trade.profit_loss or ''},{trade.profit_loss_pips or ''}," \
-                          f"{trade.status.value},{trade.strategy.value if trade.strategy else ''}," \
-                          f"{trade.emotional_state.value},{trade.confidence_level},{trade.stress_level}," \
-                          f"{trade.risk_reward_ratio},\"{trade.notes}\",\"{';'.join(trade.tags)}\"\n"
-        
-        return csv_content
+        # csv.writer échappe les guillemets, virgules et retours à la ligne des notes
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(CSV_HEADER)
+        writer.writerows(self._csv_row(trade) for trade in trades)
+        
+        return buffer.getvalue()
+    
+    def _csv_row(self, trade: SmartTradeEntry) -> tuple:
+        """Ligne CSV d'un trade"""
+        return (
+            trade.trade_id, trade.pair_symbol, trade.direction, trade.lot_size,
+            trade.entry_price, trade.exit_price or '',
+            trade.stop_loss, trade.take_profit,
+            trade.entry_time.isoformat(), trade.exit_time.isoformat() if trade.exit_time else '',
+            trade.profit_loss or '', trade.profit_loss_pips or '',
+            trade.status.value, trade.strategy.value if trade.strategy else '',
+            trade.emotional_state.value, trade.confidence_level, trade.stress_level,
+            trade.risk_reward_ratio, trade.notes, ';'.join(trade.tags)
+        )
 
 # Instance globale du journal intelligent
 smart_journal = SmartJournalManager()
\ No newline at end of file
@@ -3,12 +3,91 @@ Suggestion Manager - Module de gestion des suggestions communautaires
 Permet aux utilisateurs de proposer des idées et de voter pour celles des autres
 """
 
+import queue
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 
 # Configuration de la base de données
 DATABASE = 'mindtraderpro_users.db'
 
+# Nombre maximal de connexions conservées dans le pool
+POOL_SIZE = 8
+
+# Nombre de requêtes préparées conservées par connexion
+STATEMENT_CACHE_SIZE = 256
+
+# Taille de la projection mémoire du fichier de base (octets)
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Colonnes communes des listes et fiches de suggestions : le nombre de votes est
+# maintenu par triggers, le vote de l'utilisateur (1er paramètre) lu par sondage d'index
+_SUGGESTION_COLUMNS = '''
+    s.id, s.user_id, u.username, s.title, s.description, s.status,
+    s.created_at, s.updated_at,
+    s.vote_count,
+    EXISTS(SELECT 1 FROM suggestion_votes uv WHERE uv.suggestion_id = s.id AND uv.user_id = ?) AS user_has_voted
+'''
+
+# Requêtes construites une seule fois : un texte SQL identique d'un appel à
+# l'autre est retrouvé dans le cache de requêtes préparées de la connexion
+_SELECT_SUGGESTIONS_SQL = f'''
+    SELECT {_SUGGESTION_COLUMNS}
+    FROM suggestions s
+    JOIN users u ON s.user_id = u.id
+    WHERE 1=1
+'''
+
+_SELECT_SUGGESTION_BY_ID_SQL = f'''
+    SELECT {_SUGGESTION_COLUMNS}
+    FROM suggestions s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.id = ?
+'''
+
+# ============================================================================
+# POOL DE CONNEXIONS SQLITE
+# ============================================================================
+
+_connection_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def _open_connection():
+    """Ouvre une connexion configurée pour le pool"""
+    # isolation_level=None : les transactions sont ouvertes explicitement (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(
+        DATABASE,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    # Le WAL n'existe que pour une base sur fichier
+    if DATABASE != ':memory:':
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+@contextmanager
+def get_connection():
+    """Emprunte une connexion au pool et la restitue en sortie de bloc"""
+    try:
+        conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    
+    try:
+        yield conn
+    finally:
+        # Une transaction non validée est annulée, comme à la fermeture d'une connexion
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _connection_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 # ============================================================================
 # GESTION DES SUGGESTIONS
 # ============================================================================
@@ -37,18 +116,16 @@ def create_suggestion(user_id, title, description):
         if len(description) > 2000:
             return {'success': False, 'error': 'Description limitée à 2000 caractères'}
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Insertion de la nouvelle suggestion
-        cursor.execute('''
-            INSERT INTO suggestions (user_id, title, description, status, created_at)
-            VALUES (?, ?, ?, 'proposed', CURRENT_TIMESTAMP)
-        ''', (user_id, title.strip(), description.strip()))
-        
-        suggestion_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Insertion de la nouvelle suggestion (instruction unique, validée automatiquement)
+            cursor.execute('''
+                INSERT INTO suggestions (user_id, title, description, status, created_at)
+                VALUES (?, ?, ?, 'proposed', CURRENT_TIMESTAMP)
+            ''', (user_id, title.strip(), description.strip()))
+            
+            suggestion_id = cursor.lastrowid
         
         return {'success': True, 'suggestion_id': suggestion_id, 'message': 'Suggestion créée avec succès !'}
         
@@ -70,21 +147,9 @@ def get_all_suggestions(limit=50, offset=0, sort_by='recent', user_id=None, filt
         list: Liste des suggestions avec informations complètes
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Construction de la requête de base avec jointures
-        query = '''
-            SELECT s.id, s.user_id, u.username, s.title, s.description, s.status,
-                   s.created_at, s.updated_at,
-                   COUNT(v.id) as vote_count,
-                   CASE WHEN uv.user_id IS NOT NULL THEN 1 ELSE 0 END as user_has_voted
-            FROM suggestions s
-            JOIN users u ON s.user_id = u.id
-            LEFT JOIN suggestion_votes v ON s.id = v.suggestion_id
-            LEFT JOIN suggestion_votes uv ON s.id = uv.suggestion_id AND uv.user_id = ?
-            WHERE 1=1
-        '''
+        # Requête de base (votes lus par sous-requêtes indexées) ; les variantes
+        # filtre/tri sont en nombre fini et restent dans le cache de requêtes
+        query = _SELECT_SUGGESTIONS_SQL
         params = [user_id or 0]
         
         # Application des filtres
@@ -97,9 +162,6 @@ def get_all_suggestions(limit=50, offset=0, sort_by='recent', user_id=None, filt
             query += ' AND s.user_id = ?'
             params.append(user_id)
         
-        # Regroupement pour compter les votes
-        query += ' GROUP BY s.id, s.user_id, u.username, s.title, s.description, s.status, s.created_at, s.updated_at, uv.user_id'
-        
         # Application du tri
         if sort_by == 'popular':
             query += ' ORDER BY vote_count DESC, s.created_at DESC'
@@ -112,9 +174,10 @@ def get_all_suggestions(limit=50, offset=0, sort_by='recent', user_id=None, filt
         query += ' LIMIT ? OFFSET ?'
         params.extend([limit, offset])
         
-        cursor.execute(query, params)
-        suggestions = cursor.fetchall()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            suggestions = cursor.fetchall()
         
         suggestions_list = []
         for suggestion in suggestions:
@@ -149,24 +212,10 @@ def get_suggestion_by_id(suggestion_id, user_id=None):
         dict: Détails de la suggestion ou None
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT s.id, s.user_id, u.username, s.title, s.description, s.status,
-                   s.created_at, s.updated_at,
-                   COUNT(v.id) as vote_count,
-                   CASE WHEN uv.user_id IS NOT NULL THEN 1 ELSE 0 END as user_has_voted
-            FROM suggestions s
-            JOIN users u ON s.user_id = u.id
-            LEFT JOIN suggestion_votes v ON s.id = v.suggestion_id
-            LEFT JOIN suggestion_votes uv ON s.id = uv.suggestion_id AND uv.user_id = ?
-            WHERE s.id = ?
-            GROUP BY s.id, s.user_id, u.username, s.title, s.description, s.status, s.created_at, s.updated_at, uv.user_id
-        ''', (user_id or 0, suggestion_id))
-        
-        suggestion = cursor.fetchone()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SELECT_SUGGESTION_BY_ID_SQL, (user_id or 0, suggestion_id))
+            suggestion = cursor.fetchone()
         
         if suggestion:
             return {
@@ -212,30 +261,22 @@ def update_suggestion(suggestion_id, user_id, title, description):
         if len(description) > 2000:
             return {'success': False, 'error': 'Description limitée à 2000 caractères'}
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Vérification que l'utilisateur est propriétaire de la suggestion
-        cursor.execute('SELECT user_id FROM suggestions WHERE id = ?', (suggestion_id,))
-        suggestion = cursor.fetchone()
-        
-        if not suggestion:
-            conn.close()
-            return {'success': False, 'error': 'Suggestion non trouvée'}
-        
-        if suggestion[0] != user_id:
-            conn.close()
-            return {'success': False, 'error': 'Vous ne pouvez modifier que vos propres suggestions'}
-        
-        # Mise à jour de la suggestion
-        cursor.execute('''
-            UPDATE suggestions 
-            SET title = ?, description = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ? AND user_id = ?
-        ''', (title.strip(), description.strip(), suggestion_id, user_id))
-        
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Mise à jour conditionnée à la propriété, atomique en une instruction
+            cursor.execute('''
+                UPDATE suggestions 
+                SET title = ?, description = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND user_id = ?
+            ''', (title.strip(), description.strip(), suggestion_id, user_id))
+            
+            if cursor.rowcount == 0:
+                # Aucune ligne modifiée : suggestion absente ou d'un autre auteur
+                cursor.execute('SELECT 1 FROM suggestions WHERE id = ?', (suggestion_id,))
+                if not cursor.fetchone():
+                    return {'success': False, 'error': 'Suggestion non trouvée'}
+                return {'success': False, 'error': 'Vous ne pouvez modifier que vos propres suggestions'}
         
         return {'success': True, 'message': 'Suggestion mise à jour avec succès'}
         
@@ -254,29 +295,19 @@ def delete_suggestion(suggestion_id, user_id):
         dict: Résultat de la suppression
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Vérification de propriété
-        cursor.execute('SELECT user_id FROM suggestions WHERE id = ?', (suggestion_id,))
-        suggestion = cursor.fetchone()
-        
-        if not suggestion:
-            conn.close()
-            return {'success': False, 'error': 'Suggestion non trouvée'}
-        
-        if suggestion[0] != user_id:
-            conn.close()
-            return {'success': False, 'error': 'Vous ne pouvez supprimer que vos propres suggestions'}
-        
-        # Suppression des votes associés
-        cursor.execute('DELETE FROM suggestion_votes WHERE suggestion_id = ?', (suggestion_id,))
-        
-        # Suppression de la suggestion
-        cursor.execute('DELETE FROM suggestions WHERE id = ? AND user_id = ?', (suggestion_id, user_id))
-        
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Suppression conditionnée à la propriété ; les votes associés sont
+            # supprimés dans la même instruction par trg_suggestions_delete_votes
+            cursor.execute('DELETE FROM suggestions WHERE id = ? AND user_id = ?', (suggestion_id, user_id))
+            
+            if cursor.rowcount == 0:
+                # Aucune ligne supprimée : suggestion absente ou d'un autre auteur
+                cursor.execute('SELECT 1 FROM suggestions WHERE id = ?', (suggestion_id,))
+                if not cursor.fetchone():
+                    return {'success': False, 'error': 'Suggestion non trouvée'}
+                return {'success': False, 'error': 'Vous ne pouvez supprimer que vos propres suggestions'}
         
         return {'success': True, 'message': 'Suggestion supprimée avec succès'}
         
@@ -299,41 +330,37 @@ def toggle_vote(suggestion_id, user_id):
         dict: Résultat de l'action avec nouveau statut
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Vérification que la suggestion existe
-        cursor.execute('SELECT id FROM suggestions WHERE id = ?', (suggestion_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return {'success': False, 'error': 'Suggestion non trouvée'}
-        
-        # Vérification si l'utilisateur a déjà voté
-        cursor.execute('SELECT id FROM suggestion_votes WHERE suggestion_id = ? AND user_id = ?', 
-                      (suggestion_id, user_id))
-        existing_vote = cursor.fetchone()
-        
-        if existing_vote:
-            # Retirer le vote
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Retrait du vote s'il existe : une seule descente dans l'index
+            # UNIQUE(suggestion_id, user_id) sert à la fois de test et de suppression
             cursor.execute('DELETE FROM suggestion_votes WHERE suggestion_id = ? AND user_id = ?', 
                           (suggestion_id, user_id))
-            action = 'removed'
-            message = 'Vote retiré'
-        else:
-            # Ajouter le vote
-            cursor.execute('''
-                INSERT INTO suggestion_votes (suggestion_id, user_id, created_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            ''', (suggestion_id, user_id))
-            action = 'added'
-            message = 'Vote ajouté'
-        
-        # Récupération du nouveau compte de votes
-        cursor.execute('SELECT COUNT(*) FROM suggestion_votes WHERE suggestion_id = ?', (suggestion_id,))
-        new_vote_count = cursor.fetchone()[0]
-        
-        conn.commit()
-        conn.close()
+            
+            if cursor.rowcount:
+                action = 'removed'
+                message = 'Vote retiré'
+            else:
+                # Ajouter le vote
+                cursor.execute('''
+                    INSERT INTO suggestion_votes (suggestion_id, user_id, created_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (suggestion_id, user_id))
+                action = 'added'
+                message = 'Vote ajouté'
+            
+            # Récupération du nouveau compte de votes (maintenu par trigger), qui
+            # vérifie aussi l'existence de la suggestion
+            cursor.execute('SELECT vote_count FROM suggestions WHERE id = ?', (suggestion_id,))
+            row = cursor.fetchone()
+            if row is None:
+                # Transaction non validée : annulée par get_connection()
+                return {'success': False, 'error': 'Suggestion non trouvée'}
+            new_vote_count = row[0]
+            
+            conn.commit()
         
         return {
             'success': True, 
@@ -357,12 +384,10 @@ def get_user_votes(user_id):
         list: Liste des IDs des suggestions votées
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT suggestion_id FROM suggestion_votes WHERE user_id = ?', (user_id,))
-        votes = cursor.fetchall()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT suggestion_id FROM suggestion_votes WHERE user_id = ?', (user_id,))
+            votes = cursor.fetchall()
         
         return [vote[0] for vote in votes]
         
@@ -391,32 +416,31 @@ def update_suggestion_status(suggestion_id, new_status, admin_id):
         if new_status not in valid_statuses:
             return {'success': False, 'error': 'Statut invalide'}
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Vérification que la suggestion existe
-        cursor.execute('SELECT title, user_id FROM suggestions WHERE id = ?', (suggestion_id,))
-        suggestion = cursor.fetchone()
-        
-        if not suggestion:
-            conn.close()
-            return {'success': False, 'error': 'Suggestion non trouvée'}
-        
-        # Mise à jour du statut
-        cursor.execute('''
-            UPDATE suggestions 
-            SET status = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (new_status, suggestion_id))
-        
-        # Log de l'action administrative
-        cursor.execute('''
-            INSERT INTO admin_logs (admin_id, action, target_user_id, details, created_at)
-            VALUES (?, 'suggestion_status_change', ?, ?, CURRENT_TIMESTAMP)
-        ''', (admin_id, suggestion[1], f'Suggestion "{suggestion[0]}" - Statut changé vers: {new_status}'))
-        
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Vérification que la suggestion existe
+            cursor.execute('SELECT title, user_id FROM suggestions WHERE id = ?', (suggestion_id,))
+            suggestion = cursor.fetchone()
+            
+            if not suggestion:
+                return {'success': False, 'error': 'Suggestion non trouvée'}
+            
+            # Mise à jour du statut
+            cursor.execute('''
+                UPDATE suggestions 
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (new_status, suggestion_id))
+            
+            # Log de l'action administrative
+            cursor.execute('''
+                INSERT INTO admin_logs (admin_id, action, target_user_id, details, created_at)
+                VALUES (?, 'suggestion_status_change', ?, ?, CURRENT_TIMESTAMP)
+            ''', (admin_id, suggestion[1], f'Suggestion "{suggestion[0]}" - Statut changé vers: {new_status}'))
+            
+            conn.commit()
         
         return {'success': True, 'message': f'Statut mis à jour vers: {new_status}'}
         
@@ -431,48 +455,44 @@ def get_suggestions_statistics():
         dict: Statistiques complètes
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Statistiques par statut
-        cursor.execute('''
-            SELECT status, COUNT(*) 
-            FROM suggestions 
-            GROUP BY status
-        ''')
-        status_stats = dict(cursor.fetchall())
-        
-        # Total des suggestions
-        cursor.execute('SELECT COUNT(*) FROM suggestions')
-        total_suggestions = cursor.fetchone()[0]
-        
-        # Total des votes
-        cursor.execute('SELECT COUNT(*) FROM suggestion_votes')
-        total_votes = cursor.fetchone()[0]
-        
-        # Suggestions les plus populaires
-        cursor.execute('''
-            SELECT s.id, s.title, COUNT(v.id) as vote_count
-            FROM suggestions s
-            LEFT JOIN suggestion_votes v ON s.id = v.suggestion_id
-            GROUP BY s.id, s.title
-            ORDER BY vote_count DESC
-            LIMIT 5
-        ''')
-        popular_suggestions = cursor.fetchall()
-        
-        # Utilisateurs les plus actifs
-        cursor.execute('''
-            SELECT u.username, COUNT(s.id) as suggestion_count
-            FROM users u
-            JOIN suggestions s ON u.id = s.user_id
-            GROUP BY u.id, u.username
-            ORDER BY suggestion_count DESC
-            LIMIT 5
-        ''')
-        active_users = cursor.fetchall()
-        
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Statistiques par statut
+            cursor.execute('''
+                SELECT status, COUNT(*) 
+                FROM suggestions 
+                GROUP BY status
+            ''')
+            status_stats = dict(cursor.fetchall())
+            
+            # Total des suggestions
+            cursor.execute('SELECT COUNT(*) FROM suggestions')
+            total_suggestions = cursor.fetchone()[0]
+            
+            # Total des votes
+            cursor.execute('SELECT COUNT(*) FROM suggestion_votes')
+            total_votes = cursor.fetchone()[0]
+            
+            # Suggestions les plus populaires
+            cursor.execute('''
+                SELECT id, title, vote_count
+                FROM suggestions
+                ORDER BY vote_count DESC, created_at DESC
+                LIMIT 5
+            ''')
+            popular_suggestions = cursor.fetchall()
+            
+            # Utilisateurs les plus actifs
+            cursor.execute('''
+                SELECT u.username, COUNT(s.id) as suggestion_count
+                FROM users u
+                JOIN suggestions s ON u.id = s.user_id
+                GROUP BY u.id, u.username
+                ORDER BY suggestion_count DESC
+                LIMIT 5
+            ''')
+            active_users = cursor.fetchall()
         
         return {
             'total_suggestions': total_suggestions,
@@ -534,43 +554,85 @@ def init_suggestions_tables():
     Initialise les tables nécessaires pour les suggestions communautaires
     """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Table des suggestions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS suggestions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                description TEXT NOT NULL,
-                status TEXT DEFAULT 'proposed',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Table des votes sur les suggestions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS suggestion_votes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                suggestion_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(suggestion_id, user_id),
-                FOREIGN KEY (suggestion_id) REFERENCES suggestions (id),
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Index pour améliorer les performances
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_status ON suggestions(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_created_at ON suggestions(created_at)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestion_votes_suggestion_id ON suggestion_votes(suggestion_id)')
-        
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Table des suggestions
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS suggestions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    status TEXT DEFAULT 'proposed',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    vote_count INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Compteur de votes dénormalisé pour les bases existantes
+            try:
+                cursor.execute('ALTER TABLE suggestions ADD COLUMN vote_count INTEGER NOT NULL DEFAULT 0')
+                needs_backfill = True
+            except sqlite3.OperationalError:
+                needs_backfill = False  # Colonne déjà existante
+            
+            # Table des votes sur les suggestions
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS suggestion_votes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    suggestion_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(suggestion_id, user_id),
+                    FOREIGN KEY (suggestion_id) REFERENCES suggestions (id),
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Index pour améliorer les performances
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_status ON suggestions(status)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_created_at ON suggestions(created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestion_votes_suggestion_id ON suggestion_votes(suggestion_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_votes_created ON suggestions(vote_count DESC, created_at DESC)')
+            
+            # Maintien du compteur de votes
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_suggestion_votes_insert
+                AFTER INSERT ON suggestion_votes
+                BEGIN
+                    UPDATE suggestions SET vote_count = vote_count + 1 WHERE id = NEW.suggestion_id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_suggestion_votes_delete
+                AFTER DELETE ON suggestion_votes
+                BEGIN
+                    UPDATE suggestions SET vote_count = vote_count - 1 WHERE id = OLD.suggestion_id;
+                END
+            ''')
+            
+            # Suppression des votes avec leur suggestion (cascade sans activer foreign_keys)
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_suggestions_delete_votes
+                AFTER DELETE ON suggestions
+                BEGIN
+                    DELETE FROM suggestion_votes WHERE suggestion_id = OLD.id;
+                END
+            ''')
+            
+            # Remplissage initial à partir des votes existants
+            if needs_backfill:
+                cursor.execute('''
+                    UPDATE suggestions SET vote_count = (
+                        SELECT COUNT(*) FROM suggestion_votes v WHERE v.suggestion_id = suggestions.id
+                    )
+                ''')
+            
+            conn.commit()
         
         print("✅ Tables suggestions initialisées")
         
@@ -652,7 +652,7 @@ def admin_referral_page():
     """Page d'administration du système de parrainage"""
     try:
         # Récupération des parrainages
-        referrals_result = get_all_referrals_admin(50, 0)
+        referrals_result = get_all_referrals_admin(50)
         if not referrals_result['success']:
             return f"Erreur: {referrals_result['error']}"
         
@@ -985,7 +985,7 @@ def admin_export_referrals_csv():
         import csv
         
         # Récupération de tous les parrainages
-        referrals_result = get_all_referrals_admin(1000, 0)
+        referrals_result = get_all_referrals_admin(1000)
         if not referrals_result['success']:
             return f"Erreur: {referrals_result['error']}"
         